@@ -1,17 +1,22 @@
 import argparse
+import asyncio
 import atexit
+import bisect
 import calendar
 import codecs
 import collections
+import concurrent.futures
+import contextlib
 import datetime
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 import fileinput
 from functools import wraps
+import glob
 import hashlib
-import inspect
 import json
 import logging
+import mmap
 import multiprocessing
 from multiprocessing import Pool
 import operator
@@ -22,13 +27,17 @@ import platform
 import random
 import re
 import select
+import shlex
 import shutil
 import smtplib
 import socket
+import sqlite3
 import subprocess
 import sys
+import tarfile
 import threading
 import time
+import urllib.parse
 import uuid
 import zipfile
 
@@ -95,6 +104,234 @@ def retry(ExceptionToCheck, tries=4, delay=3, backoff=2, logger=None):
     return deco_retry
 
 
+class _HostFact:
+    """Class attribute of Util that is computed on first access instead of at import time.
+
+    Values are cached in ScriptRepo.IGNORE_HOST_FILE together with the boot id, so later processes on the
+    same boot don't compute them again. Hosts without a boot id only cache them in memory.
+    """
+
+    cache = None
+
+    def __init__(self, func):
+        self.func = func
+        self.name = func.__name__
+
+    def __get__(self, obj, owner):
+        cache = _HostFact._load_cache()
+        if self.name in cache['facts']:
+            value = cache['facts'][self.name]
+        else:
+            value = self.func()
+            cache['facts'][self.name] = value
+            if cache['boot_id']:
+                _HostFact._dump_cache(cache)
+        # Replace the descriptor so that later accesses are plain attribute lookups
+        setattr(owner, self.name, value)
+        return value
+
+    @staticmethod
+    def _load_cache():
+        if _HostFact.cache is None:
+            boot_id = Util.get_boot_id()
+            cache = {'boot_id': boot_id, 'facts': {}}
+            if boot_id and os.path.exists(ScriptRepo.IGNORE_HOST_FILE):
+                try:
+                    tmp_cache = Util.load_json(ScriptRepo.IGNORE_HOST_FILE)
+                    if tmp_cache.get('boot_id') == boot_id:
+                        cache = tmp_cache
+                except Exception:
+                    pass
+            _HostFact.cache = cache
+        return _HostFact.cache
+
+    @staticmethod
+    def _dump_cache(cache):
+        try:
+            Util.dump_json(ScriptRepo.IGNORE_HOST_FILE, cache, indent=None, atomic=True)
+        except OSError:
+            pass
+
+
+GpuInfo = collections.namedtuple('GpuInfo', ['name', 'driver_date', 'driver_ver', 'device_id', 'vendor_id'])
+HostInfo = collections.namedtuple('HostInfo', ['os', 'os_ver', 'cpu', 'cpu_count', 'gpus'])
+
+
+class HostInventory:
+    """GPU, driver, OS and CPU facts of the host as a HostInfo, which are probed once per process.
+
+    The HostInfo is cached in ScriptRepo.IGNORE_INVENTORY_FILE, which is valid until the next boot or until the
+    drivers in Util.INVENTORY_DRIVER_FILES or LD_LIBRARY_PATH (e.g., by Util.set_mesa()) change.
+    """
+
+    info = None
+    key = None
+    lock = threading.Lock()
+
+    @staticmethod
+    def get(refresh=False):
+        # The key is checked on every call, as drivers and LD_LIBRARY_PATH may change within the process. The boot id
+        # is left out, as it can't change within the process, while the one of Windows is computed with some jitter.
+        key = HostInventory._get_key()
+        with HostInventory.lock:
+            changed = HostInventory.key is None or dict(key, boot_id='') != dict(HostInventory.key, boot_id='')
+            if refresh or HostInventory.info is None or changed:
+                info = None if refresh else HostInventory._load(key)
+                if not info:
+                    info = HostInventory._probe()
+                    # Don't keep a failed probe, or results of a host without a boot id, across processes
+                    if info.gpus and key['boot_id']:
+                        try:
+                            content = dict(info._asdict(), gpus=[gpu._asdict() for gpu in info.gpus], key=key)
+                            Util.dump_json(ScriptRepo.IGNORE_INVENTORY_FILE, content, atomic=True)
+                        except OSError:
+                            pass
+                HostInventory.info = info
+                HostInventory.key = key
+            return HostInventory.info
+
+    @staticmethod
+    def _probe():
+        return HostInfo(Util.HOST_OS, Util._probe_os_ver(), Util._probe_cpu_name(), Util.CPU_COUNT, Util._probe_gpus())
+
+    @staticmethod
+    def _get_key():
+        mtimes = {}
+        for file_path in Util.INVENTORY_DRIVER_FILES.get(Util.HOST_OS, []):
+            try:
+                mtimes[file_path] = os.stat(file_path).st_mtime
+            except OSError:
+                pass
+        return {'boot_id': Util.get_boot_id(), 'mtimes': mtimes, 'ld_library_path': os.getenv('LD_LIBRARY_PATH', '')}
+
+    @staticmethod
+    def _load(key):
+        if not os.path.exists(ScriptRepo.IGNORE_INVENTORY_FILE):
+            return None
+        try:
+            content = Util.load_json(ScriptRepo.IGNORE_INVENTORY_FILE)
+            if content.pop('key') != key:
+                return None
+            content['gpus'] = [GpuInfo(**gpu) for gpu in content['gpus']]
+            return HostInfo(**content)
+        except Exception:
+            return None
+
+
+# exists and version are probed once, and version is '' if it's unknown
+BrowserInfo = collections.namedtuple('BrowserInfo', ['browser_name', 'target_os', 'path', 'exists', 'version'])
+
+
+class BrowserPathResolver:
+    """Resolve (browser_name, target_os) to a BrowserInfo from the candidate paths in Util.BROWSER_PATHS.
+
+    The first existing candidate wins, or the first one if none exists. Each combination is resolved once per
+    process, and versions are cached in ScriptRepo.IGNORE_BROWSER_FILE by path and mtime, so a browser is only run
+    to get its version again after it's updated.
+    """
+
+    infos = {}
+    versions = None
+    # path -> lock, so that a browser is run once for its version while others wait for that path only
+    path_locks = {}
+    lock = threading.Lock()
+
+    @staticmethod
+    def resolve(browser_name, target_os=None):
+        if not target_os:
+            target_os = Util.HOST_OS
+        key = (browser_name, target_os)
+        with BrowserPathResolver.lock:
+            info = BrowserPathResolver.infos.get(key)
+        if info:
+            return info
+        # Probed without the lock, as getting the version may run the browser
+        info = BrowserPathResolver._probe(browser_name, target_os)
+        with BrowserPathResolver.lock:
+            return BrowserPathResolver.infos.setdefault(key, info)
+
+    @staticmethod
+    def _probe(browser_name, target_os):
+        paths = Util.BROWSER_PATHS.get(target_os, {})
+        candidates = paths.get(browser_name, paths.get('*'))
+        if not candidates:
+            Util.error('Unknown browser %s on %s' % (browser_name, target_os))
+
+        # Dirs which are not defined for the host are left empty
+        variables = {
+            'chromium_dir': getattr(Util, 'PROJECT_CHROMIUM_DIR', ''),
+            'out_dir': '',
+            'appdata_dir': getattr(Util, 'APPDATA_DIR', ''),
+            'localappdata_dir': getattr(Util, 'LOCALAPPDATA_DIR', ''),
+            'programfiles_dir': getattr(Util, 'PROGRAMFILES_DIR', ''),
+        }
+        if any('{chromium_dir}' in candidate for candidate in candidates) and not variables['chromium_dir']:
+            Util.error('Util.PROJECT_CHROMIUM_DIR must be set to find %s on %s' % (browser_name, target_os))
+        if any('{out_dir}' in candidate for candidate in candidates):
+            variables['out_dir'] = Util.cal_relative_out_dir('x86_64', Util.HOST_OS)
+        candidates = [candidate.format(**variables) for candidate in candidates]
+        for path in candidates:
+            try:
+                mtime = os.stat(path).st_mtime
+            except OSError:
+                continue
+            return BrowserInfo(browser_name, target_os, path, True, BrowserPathResolver._get_version(path, mtime))
+        return BrowserInfo(browser_name, target_os, candidates[0], False, '')
+
+    @staticmethod
+    def _get_version(path, mtime):
+        with BrowserPathResolver.lock:
+            path_lock = BrowserPathResolver.path_locks.setdefault(path, threading.Lock())
+        with path_lock:
+            with BrowserPathResolver.lock:
+                versions = BrowserPathResolver._load_versions()
+                if path in versions and versions[path][0] == mtime:
+                    return versions[path][1]
+
+            version = BrowserPathResolver._run_version(path)
+            with BrowserPathResolver.lock:
+                versions[path] = [mtime, version]
+                try:
+                    Util.dump_json(ScriptRepo.IGNORE_BROWSER_FILE, versions, atomic=True)
+                except OSError:
+                    pass
+            return version
+
+    @staticmethod
+    def _load_versions():
+        if BrowserPathResolver.versions is None:
+            BrowserPathResolver.versions = {}
+            if os.path.exists(ScriptRepo.IGNORE_BROWSER_FILE):
+                try:
+                    BrowserPathResolver.versions = Util.load_json(ScriptRepo.IGNORE_BROWSER_FILE)
+                except ValueError:
+                    pass
+        return BrowserPathResolver.versions
+
+    @staticmethod
+    def _run_version(path):
+        version = ''
+        if Util.HOST_OS == Util.WINDOWS:
+            # chrome.exe doesn't print its version, which is the name of a dir next to it. Dirs of the old and new
+            # versions are both there during an update, so take the highest one.
+            version_dirs = [
+                file_name
+                for file_name in os.listdir(os.path.dirname(path))
+                if re.match(r'\d+\.\d+\.\d+\.\d+$', file_name)
+            ]
+            if version_dirs:
+                version = max(version_dirs, key=lambda v: tuple(map(int, v.split('.'))))
+        else:
+            try:
+                out = subprocess.check_output([path, '--version'], stderr=subprocess.DEVNULL, timeout=30)
+                match = re.search(r'(\d+(\.\d+)+)', out.decode(errors='replace'))
+                if match:
+                    version = match.group(1)
+            except (OSError, subprocess.SubprocessError):
+                pass
+        return version
+
+
 class Util:
     @staticmethod
     def execute(
@@ -107,6 +344,10 @@ class Util:
         shell=True,
         log_file='',
         timeout=0,
+        fail_file=True,
+        stream=False,
+        line_callback=None,
+        tail_lines=1000,
     ):
         if show_duration:
             timer = Timer()
@@ -114,39 +355,66 @@ class Util:
         orig_cmd = cmd
         if show_cmd:
             Util.cmd(orig_cmd)
+        # Keep buffered messages ahead of the output of cmd
+        Util.flush_log()
+
+        # With fail_file, failure is detected by a sentinel file that is only removed if cmd succeeds.
+        # Without it, the exit status comes from the process itself and log_file is written by an
+        # in-process tee, so no file is touched and no extra shell or tee process is spawned.
+        # stream reads the output incrementally and only keeps the last tail_lines lines as out,
+        # which also implies the in-process tee.
+        tee = stream or (log_file and not fail_file)
+        if fail_file:
+            fail_file = Util.format_slash('%s-%s' % (ScriptRepo.IGNORE_FAIL_FILE, uuid.uuid4()))
+            if not dryrun:
+                Util.ensure_file(fail_file)
+                if Util.HOST_OS == Util.WINDOWS:
+                    remove_cmd = 'del'
+                else:
+                    remove_cmd = 'rm'
+                cmd = '%s && %s %s' % (cmd, remove_cmd, fail_file)
 
-        fail_file = Util.format_slash('%s-%s' % (ScriptRepo.IGNORE_FAIL_FILE, uuid.uuid4()))
-        if not dryrun:
-            Util.ensure_file(fail_file)
-            if Util.HOST_OS == Util.WINDOWS:
-                remove_cmd = 'del'
-            else:
-                remove_cmd = 'rm'
-            cmd = '%s && %s %s' % (cmd, remove_cmd, fail_file)
-
-        if log_file:
-            cmd = '(%s) 2>&1 | tee -a %s' % (cmd, log_file)
+            if log_file and not tee:
+                cmd = '(%s) 2>&1 | tee -a %s' % (cmd, log_file)
 
         ret = 0
         out = ''
-        if timeout or return_out:
-            process = subprocess.Popen(
-                cmd, shell=shell, stdout=subprocess.PIPE, stderr=subprocess.PIPE, encoding='utf8'
-            )
+        if tee or timeout or return_out:
+            if tee:
+                process = subprocess.Popen(cmd, shell=shell, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            else:
+                process = subprocess.Popen(
+                    cmd, shell=shell, stdout=subprocess.PIPE, stderr=subprocess.PIPE, encoding='utf8'
+                )
             if timeout:
                 process_timer = threading.Timer(timeout, process.kill)
                 process_timer.start()
             try:
-                out, _ = process.communicate()
+                if stream:
+                    out = Util._stream(
+                        process,
+                        log_file=log_file,
+                        line_callback=line_callback,
+                        tail_lines=tail_lines,
+                        echo=not return_out,
+                    )
+                elif tee:
+                    out = Util._stream(
+                        process, log_file=log_file, tail_lines=None if return_out else 0, echo=not return_out
+                    )
+                else:
+                    out, _ = process.communicate()
             finally:
                 if timeout:
                     if not process_timer.is_alive():
                         ret = 1
                     process_timer.cancel()
+            if not fail_file and not ret:
+                ret = process.returncode
         else:
             ret = os.system(cmd)
 
-        if os.path.exists(fail_file):
+        if fail_file and os.path.exists(fail_file):
             Util.ensure_nofile(fail_file)
             if not ret:
                 ret = 1
@@ -160,11 +428,142 @@ class Util:
         if show_duration:
             Util.info(
                 '%s was spent to execute command "%s" in function "%s"'
-                % (timer.stop(), orig_cmd, inspect.stack()[1][3])
+                % (timer.stop(), orig_cmd, sys._getframe(1).f_code.co_name)
+            )
+
+        return [ret, out]
+
+    @staticmethod
+    # asyncio variant of execute() so that many commands can be in flight on one event loop.
+    # The exit status always comes from the process, and log_file is written through the default executor.
+    async def execute_async(
+        cmd,
+        show_cmd=True,
+        exit_on_error=True,
+        return_out=False,
+        show_duration=False,
+        log_file='',
+        timeout=0,
+    ):
+        if show_duration:
+            timer = Timer()
+
+        if show_cmd:
+            Util.cmd(cmd)
+        Util.flush_log()
+
+        if log_file:
+            stdout = asyncio.subprocess.PIPE
+            stderr = asyncio.subprocess.STDOUT
+        elif return_out:
+            stdout = asyncio.subprocess.PIPE
+            stderr = asyncio.subprocess.PIPE
+        else:
+            stdout = None
+            stderr = None
+        process = await asyncio.create_subprocess_shell(cmd, stdout=stdout, stderr=stderr)
+
+        async def _communicate():
+            if not log_file:
+                out, _ = await process.communicate()
+                return out
+
+            loop = asyncio.get_running_loop()
+            chunks = []
+            with open(log_file, 'ab') as f:
+                while True:
+                    chunk = await process.stdout.read(65536)
+                    if not chunk:
+                        break
+                    await loop.run_in_executor(None, f.write, chunk)
+                    if return_out:
+                        chunks.append(chunk)
+                    else:
+                        sys.stdout.write(chunk.decode('utf8', errors='replace'))
+                        sys.stdout.flush()
+            await process.wait()
+            return b''.join(chunks)
+
+        ret = 0
+        out = ''
+        try:
+            out = await asyncio.wait_for(_communicate(), timeout or None)
+        except asyncio.TimeoutError:
+            process.kill()
+            await process.wait()
+            ret = 1
+        if not ret:
+            ret = process.returncode
+        if out:
+            out = out.decode('utf8', errors='replace')
+        else:
+            out = ''
+
+        if ret:
+            if exit_on_error:
+                Util.error('Failed to execute command [%s]' % cmd)
+            else:
+                Util.warning('Failed to execute command [%s]' % cmd)
+
+        if show_duration:
+            Util.info(
+                '%s was spent to execute command "%s" in function "%s"'
+                % (timer.stop(), cmd, sys._getframe(1).f_code.co_name)
             )
 
         return [ret, out]
 
+    @staticmethod
+    # Read stdout and stderr of process chunk by chunk as they arrive, copy them to log_file and to the console
+    # if echo is set, call line_callback for every line, and return the last tail_lines lines of stdout.
+    # tail_lines=None keeps all lines, and tail_lines=0 keeps none. stderr is read in another thread, as select()
+    # can't wait on pipes on Windows.
+    def _stream(process, log_file='', line_callback=None, tail_lines=1000, echo=True):
+        tail = collections.deque(maxlen=tail_lines)
+        log = open(log_file, 'ab') if log_file else None
+        lock = threading.Lock()
+
+        def read(pipe, console, lines_out):
+            # A multibyte character may be split across chunks
+            decoder = codecs.getincrementaldecoder('utf8')(errors='replace')
+            partial_line = b''
+            while True:
+                chunk = os.read(pipe.fileno(), 65536)
+                if chunk:
+                    lines = (partial_line + chunk).split(b'\n')
+                    partial_line = lines.pop()
+                else:
+                    lines = [partial_line] if partial_line else []
+
+                with lock:
+                    if log and chunk:
+                        log.write(chunk)
+                    if echo:
+                        console.write(decoder.decode(chunk, final=not chunk))
+                        console.flush()
+                    for line in lines:
+                        line = line.decode('utf8', errors='replace').rstrip('\r')
+                        if lines_out is not None:
+                            lines_out.append(line)
+                        if line_callback:
+                            line_callback(line)
+                if not chunk:
+                    return
+
+        thread = None
+        if process.stderr:
+            thread = threading.Thread(target=read, args=(process.stderr, sys.stderr, None))
+            thread.start()
+        try:
+            read(process.stdout, sys.stdout, tail)
+        finally:
+            if thread:
+                thread.join()
+            if log:
+                log.close()
+        process.wait()
+        return ''.join('%s\n' % line for line in tail)
+
     @staticmethod
     # Do not care about out, log_file
     # Do care about timeout
@@ -174,6 +573,7 @@ class Util:
 
         if show_cmd:
             Util.cmd(cmd)
+        Util.flush_log()
 
         # fail_file can be deleted only if shell is False
         if timeout:
@@ -199,18 +599,131 @@ class Util:
 
         if show_duration:
             Util.info(
-                '%s was spent to execute command "%s" in function "%s"' % (timer.stop(), cmd, inspect.stack()[1][3])
+                '%s was spent to execute command "%s" in function "%s"'
+                % (timer.stop(), cmd, sys._getframe(1).f_code.co_name)
             )
 
         return [ret, '']
 
     @staticmethod
+    # Run independent commands concurrently and return [ret, out] of each command in input order.
+    # Commands are shelled out, so threads are enough to keep max_workers processes in flight.
+    def execute_many(
+        cmds,
+        max_workers=0,
+        show_cmd=True,
+        exit_on_error=True,
+        return_out=False,
+        show_duration=False,
+        dryrun=False,
+        shell=True,
+        log_file='',
+        timeout=0,
+        fail_file=True,
+    ):
+        if show_duration:
+            timer = Timer()
+
+        if not max_workers:
+            max_workers = Util.CPU_COUNT
+        max_workers = max(1, min(max_workers, len(cmds)))
+
+        def _execute(cmd):
+            # Util.error() would quit inside the worker thread, so failures are reported after all commands finish
+            return Util.execute(
+                cmd,
+                show_cmd=show_cmd,
+                exit_on_error=False,
+                return_out=return_out,
+                dryrun=dryrun,
+                shell=shell,
+                log_file=log_file,
+                timeout=timeout,
+                fail_file=fail_file,
+            )
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            results = list(executor.map(_execute, cmds))
+
+        failed_cmds = [cmd for cmd, result in zip(cmds, results) if result[0]]
+        if failed_cmds and exit_on_error:
+            Util.error('Failed to execute %s of %s commands' % (len(failed_cmds), len(cmds)))
+
+        if show_duration:
+            Util.info(
+                '%s was spent to execute %s commands in function "%s"'
+                % (timer.stop(), len(cmds), sys._getframe(1).f_code.co_name)
+            )
+
+        return results
+
+    @staticmethod
+    # The name of the calling function (info, warning, ...) is the log level.
+    # sys._getframe() is used instead of inspect.stack(), which reads the source of the whole stack.
     def _msg(msg, show_strace=False):
-        m = inspect.stack()[1][3].upper()
+        frame = sys._getframe(1)
+        name = frame.f_code.co_name
+        level = Util.LOG_LEVELS.get(name, logging.INFO)
+        if level < Util.log_level:
+            return
+        if Util.log_logger and not Util.log_logger.isEnabledFor(level):
+            return
+
+        strace = ''
         if show_strace:
-            m += ', File "%s", Line: %s, Function %s' % inspect.stack()[2][1:4]
+            frame = frame.f_back
+            code = frame.f_code
+            strace = 'File "%s", Line: %s, Function %s' % (code.co_filename, frame.f_lineno, code.co_name)
+        # The logger has its own level and format
+        if Util.log_logger:
+            Util.log_logger.log(level, '%s (%s)' % (msg, strace) if strace else msg)
+            return
+
+        m = name.upper()
+        if strace:
+            m += ', ' + strace
         m = '[%s] %s' % (m, msg)
-        print(m)
+
+        with Util.log_lock:
+            buffered = Util.log_buffer is not None
+            if buffered:
+                Util.log_buffer.append(m)
+                full = len(Util.log_buffer) >= Util.LOG_BUFFER_LINES
+        if not buffered:
+            print(m)
+        elif full:
+            Util.flush_log()
+
+    @staticmethod
+    # level: name in LOG_LEVELS or level of logging module, messages below it are dropped
+    # logger: logging.Logger to send messages to, instead of printing them
+    # buffered: print messages in batches if stdout is not a tty
+    def set_log(level='debug', logger=None, buffered=False):
+        if isinstance(level, str):
+            level = Util.LOG_LEVELS[level]
+        Util.log_level = level
+        Util.log_logger = logger
+
+        Util.flush_log()
+        with Util.log_lock:
+            if buffered and not sys.stdout.isatty():
+                if Util.log_buffer is None:
+                    Util.log_buffer = []
+                    atexit.register(Util.flush_log)
+            else:
+                Util.log_buffer = None
+
+    @staticmethod
+    def flush_log():
+        # The buffer is swapped out and written under the lock, so that messages from other threads are neither lost
+        # nor written twice, and batches are written in order
+        with Util.log_lock:
+            if not Util.log_buffer:
+                return
+            messages = Util.log_buffer
+            Util.log_buffer = []
+            sys.stdout.write(''.join('%s\n' % m for m in messages))
+            sys.stdout.flush()
 
     @staticmethod
     def info(msg):
@@ -236,11 +749,12 @@ class Util:
     def error(msg, abort=True, error_code=1):
         Util._msg(msg, show_strace=True)
         if abort:
+            Util.flush_log()
             quit(error_code)
 
     @staticmethod
     def not_implemented():
-        Util.error('not_implemented() at line %s' % inspect.stack()[1][2])
+        Util.error('not_implemented() at line %s' % sys._getframe(1).f_lineno)
 
     @staticmethod
     def chdir(dir_path, verbose=False):
@@ -360,7 +874,16 @@ class Util:
         return content
 
     @staticmethod
-    def dump_json(file_path, content, indent=2, sort_keys=False):
+    # atomic: write to a temporary file and rename it, so that concurrent readers never see a partial file
+    def dump_json(file_path, content, indent=2, sort_keys=False, atomic=False):
+        if atomic:
+            Util.ensure_dir(os.path.dirname(os.path.abspath(file_path)))
+            tmp_file = '%s.%s-%s' % (file_path, os.getpid(), threading.get_ident())
+            with open(tmp_file, 'w') as f:
+                json.dump(content, f, indent=indent, sort_keys=sort_keys)
+            os.replace(tmp_file, file_path)
+            return
+
         Util.ensure_file(file_path)
         f = open(file_path, 'r+')
         f.seek(0)
@@ -391,6 +914,23 @@ class Util:
     def get_epoch_second():
         return int(time.time())
 
+    # Identify the current boot of the host, '' if it's unknown
+    @staticmethod
+    def get_boot_id():
+        if Util.HOST_OS in [Util.LINUX, Util.CHROMEOS]:
+            try:
+                with open('/proc/sys/kernel/random/boot_id') as f:
+                    return f.read().strip()
+            except OSError:
+                return ''
+        elif Util.HOST_OS == Util.WINDOWS:
+            import ctypes
+
+            # Boot time in minutes, so that the jitter between time() and GetTickCount64() doesn't matter
+            uptime = ctypes.windll.kernel32.GetTickCount64() / 1000
+            return str(int((time.time() - uptime) / 60))
+        return ''
+
     @staticmethod
     def has_recent_change(file_path, interval=24 * 3600):
         # Don't follow symlinks when getting the time of last modification of path, otherwise it
@@ -463,7 +1003,7 @@ class Util:
 
     @staticmethod
     def get_caller_name():
-        return inspect.stack()[1][3]
+        return sys._getframe(1).f_code.co_name
 
     @staticmethod
     # ver is in format a.b.c.d
@@ -654,45 +1194,19 @@ class Util:
 
     @staticmethod
     def get_browser_path(browser_name, target_os=None):
-        if not target_os:
-            target_os = Util.HOST_OS
+        return BrowserPathResolver.resolve(browser_name, target_os).path
 
-        if target_os == Util.CHROMEOS:
-            browser_path = '/opt/google/chrome/chrome'
-        elif target_os == Util.DARWIN:
-            if browser_name == 'chrome_canary':
-                browser_path = '/Applications/Google Chrome Canary.app/Contents/MacOS/Google Chrome Canary'
-            elif browser_name == 'chrome_dev':
-                browser_path = '/Applications/Google Chrome Dev.app/Contents/MacOS/Google Chrome Dev'
-            elif browser_name == 'chrome_beta':
-                browser_path = '/Applications/Google Chrome Beta.app/Contents/MacOS/Google Chrome Beta'
-            elif browser_name == 'chrome_stable':
-                browser_path = '/Applications/Google Chrome.app/Contents/MacOS/Google Chrome'
-        elif target_os == Util.LINUX:
-            if browser_name == 'chrome_dev':
-                browser_path = '/usr/bin/google-chrome-unstable'
-            elif browser_name == 'chrome_beta':
-                browser_path = '/usr/bin/google-chrome-beta'
-            elif browser_name == 'chrome_stable':
-                browser_path = '/usr/bin/google-chrome-stable'
-        elif target_os == Util.WINDOWS:
-            if browser_name == 'chrome_canary':
-                browser_path = '%s/Google/Chrome SxS/Application/chrome.exe' % Util.LOCALAPPDATA_DIR
-            elif browser_name == 'chrome_dev':
-                browser_path = '%s/Google/Chrome Dev/Application/chrome.exe' % Util.PROGRAMFILES_DIR
-            elif browser_name == 'chrome_beta':
-                browser_path = '%s/Google/Chrome Beta/Application/chrome.exe' % Util.PROGRAMFILES_DIR
-            elif browser_name == 'chrome_stable':
-                browser_path = '%s/Google/Chrome/Application/chrome.exe' % Util.PROGRAMFILES_DIR
-            elif browser_name == 'firefox_nightly':
-                browser_path = '%s/Nightly/firefox.exe' % Util.PROGRAMFILES_DIR
-            elif browser_name == 'edge':
-                browser_path = 'C:/Program Files (x86)/Microsoft/Edge/Application/msedge.exe'
-
-        return browser_path
-
-    @staticmethod
-    def get_webdriver(browser_name, browser_path='', browser_options='', webdriver_file='', debug=False, target_os=''):
+    @staticmethod
+    # user_data_dir: profile of chrome instead of ScriptRepo.USER_DATA_DIR, e.g., for concurrent sessions
+    def get_webdriver(
+        browser_name,
+        browser_path='',
+        browser_options='',
+        webdriver_file='',
+        debug=False,
+        target_os='',
+        user_data_dir='',
+    ):
         if not target_os:
             target_os = Util.HOST_OS
         # options
@@ -708,7 +1222,7 @@ class Util:
                     [
                         '--disk-cache-dir=/dev/null',
                         '--disk-cache-size=1',
-                        '--user-data-dir=%s' % (ScriptRepo.USER_DATA_DIR),
+                        '--user-data-dir=%s' % (user_data_dir or ScriptRepo.USER_DATA_DIR),
                     ]
                 )
             if debug:
@@ -720,38 +1234,7 @@ class Util:
 
         # browser_path
         if not browser_path:
-            out_dir = Util.cal_relative_out_dir('x86_64', Util.HOST_OS)
-            if target_os == Util.CHROMEOS:
-                browser_path = '/opt/google/chrome/chrome'
-            elif target_os == Util.DARWIN:
-                if browser_name == 'chrome':
-                    browser_path = (
-                        Util.PROJECT_CHROMIUM_DIR + '/%s/Release/Chromium.app/Contents/MacOS/Chromium' % out_dir
-                    )
-                elif browser_name == 'chrome_canary':
-                    browser_path = '/Applications/Google Chrome Canary.app/Contents/MacOS/Google Chrome Canary'
-            elif target_os == Util.LINUX:
-                if browser_name == 'chrome':
-                    browser_path = Util.PROJECT_CHROMIUM_DIR + '/%s/Release/chrome' % out_dir
-                elif browser_name == 'chrome_stable':
-                    browser_path = '/usr/bin/google-chrome-stable'
-                elif browser_name == 'chrome_canary':
-                    browser_path = '/usr/bin/google-chrome-unstable'
-            elif target_os == Util.WINDOWS:
-                if browser_name == 'chrome':
-                    browser_path = Util.PROJECT_CHROMIUM_DIR + '/%s/Release/chrome.exe' % out_dir
-                elif browser_name == 'chrome_stable':
-                    browser_path = '%s/Google/Chrome/Application/chrome.exe' % Util.PROGRAMFILES_DIR
-                elif browser_name == 'chrome_beta':
-                    browser_path = '%s/Google/Chrome Beta/Application/chrome.exe' % Util.PROGRAMFILES_DIR
-                elif browser_name == 'chrome_dev':
-                    browser_path = '%s/Google/Chrome Dev/Application/chrome.exe' % Util.PROGRAMFILES_DIR
-                elif browser_name == 'chrome_canary':
-                    browser_path = '%s/../Local/Google/Chrome SxS/Application/chrome.exe' % Util.APPDATA_DIR
-                elif browser_name == 'firefox_nightly':
-                    browser_path = '%s/Nightly/firefox.exe' % Util.PROGRAMFILES_DIR
-                elif browser_name == 'edge':
-                    browser_path = 'C:/windows/systemapps/Microsoft.MicrosoftEdge_8wekyb3d8bbwe/MicrosoftEdge.exe'
+            browser_path = BrowserPathResolver.resolve(browser_name, target_os).path
         # webdriver_file
         if not webdriver_file:
             if target_os == Util.CHROMEOS:
@@ -773,7 +1256,7 @@ class Util:
         if target_os == Util.CHROMEOS:
             import chromeoswebdriver
 
-            driver = chromeoswebdriver.chromedriver(extra_chrome_flags=options).driver
+            driver = chromeoswebdriver.chromedriver(extra_chrome_flags=options, shared_server=True).driver
         elif target_os in [Util.DARWIN, Util.LINUX, Util.WINDOWS]:
             if 'chrome' in browser_name:
                 chrome_options = webdriver.ChromeOptions()
@@ -811,20 +1294,110 @@ class Util:
         return driver
 
     @staticmethod
-    def get_md5(path, verbose=False):
+    # Run jobs, each a BenchmarkJob or a tuple of its fields, over up to max_workers concurrent sessions of
+    # WebDriverPool, and write results in the order of jobs to result_file. Each session has its own user data dir,
+    # and chromedriver and the browser pick their own free ports. Exclusive jobs run one by one after the others.
+    def run_benchmarks(jobs, result_file, max_workers=0, browser_options='', max_uses=50):
+        jobs = [BenchmarkJob(*job) for job in jobs]
+        if not max_workers:
+            max_workers = Util.get_benchmark_workers()
+        results = [None] * len(jobs)
+
+        def run(pool, index):
+            job = jobs[index]
+            result = {'browser_name': job.browser_name, 'url': job.url, 'exclusive': job.exclusive}
+            start_time = time.time()
+            try:
+                with pool.lease(job.browser_name, browser_options=browser_options) as driver:
+                    driver.get(job.url)
+                    result['value'] = driver.execute_script(job.script)
+            except Exception as e:
+                Util.warning('Failed to run %s on %s: %s' % (job.url, job.browser_name, e))
+                result['error'] = str(e)
+            result['duration'] = round(time.time() - start_time, 3)
+            results[index] = result
+
+        shared_indexes = [index for index, job in enumerate(jobs) if not job.exclusive]
+        exclusive_indexes = [index for index, job in enumerate(jobs) if job.exclusive]
+        Util.info(
+            'Run %d jobs over %d sessions, and %d exclusive jobs'
+            % (len(shared_indexes), max_workers, len(exclusive_indexes))
+        )
+        with WebDriverPool(size=max_workers, max_uses=max_uses) as pool:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+                for future in [executor.submit(run, pool, index) for index in shared_indexes]:
+                    future.result()
+        # The shared pool is closed by now, which waits for its pending launches and quits its idle browsers, so that
+        # an exclusive job runs with the only browser on the machine
+        if exclusive_indexes:
+            with WebDriverPool(size=1, max_uses=max_uses) as pool:
+                for index in exclusive_indexes:
+                    run(pool, index)
+
+        host = HostInventory.get()
+        content = {
+            'host': {
+                'name': Util.HOST_NAME,
+                'os_ver': host.os_ver,
+                'cpu': host.cpu,
+                'gpus': [gpu._asdict() for gpu in host.gpus],
+            },
+            'results': results,
+        }
+        Util.dump_json(result_file, content, atomic=True)
+        return results
+
+    @staticmethod
+    # Sessions to run at once, bounded by both CPUs and GPUs, as sessions on one GPU skew each other's timing
+    def get_benchmark_workers():
+        cpu_workers = Util.CPU_COUNT // Util.BENCHMARK_CPUS_PER_SESSION
+        # Software and remote display adapters reported on Windows don't render on a GPU
+        gpus = [
+            gpu
+            for gpu in HostInventory.get().gpus
+            if gpu.vendor_id != '1414' and Util._is_hardware_gpu({'Name': gpu.name})
+        ]
+        gpu_workers = max(1, len(gpus)) * Util.BENCHMARK_SESSIONS_PER_GPU
+        return max(1, min(cpu_workers, gpu_workers))
+
+    @staticmethod
+    def get_md5(path, verbose=False, use_cache=True):
         if verbose:
-            info('Calculating md5 of %s' % path)
+            Util.info('Calculating md5 of %s' % path)
+
+        # Unchanged files are looked up in Md5Cache instead of being read again
+        stat = None
+        if use_cache:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                pass
+            else:
+                md5 = Md5Cache.get(path, stat)
+                if md5:
+                    return md5
 
         if Util.need_sudo(path):
-            name = os.path.basename(path)
-            Util.execute('sudo cp %s /tmp' % path, show_cmd=False)
-            Util.execute('sudo chmod +r /tmp/%s' % name, show_cmd=False)
-            md5 = hashlib.md5(open('/tmp/%s' % name, 'rb').read()).hexdigest()
-            Util.execute('sudo rm /tmp/%s' % name, show_cmd=False)
+            process = subprocess.Popen(['sudo', 'cat', path], stdout=subprocess.PIPE)
+            md5 = Util._get_md5_from_file(process.stdout)
+            if process.wait():
+                Util.error('Failed to read %s' % path)
         else:
-            md5 = hashlib.md5(open(path, 'rb').read()).hexdigest()
+            with open(path, 'rb') as f:
+                md5 = Util._get_md5_from_file(f)
+
+        if stat:
+            Md5Cache.set(path, stat, md5)
         return md5
 
+    @staticmethod
+    # Hash in fixed-size chunks so that memory use doesn't depend on the file size
+    def _get_md5_from_file(f, chunk_size=1024 * 1024):
+        md5 = hashlib.md5()
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            md5.update(chunk)
+        return md5.hexdigest()
+
     @staticmethod
     def has_path(path):
         if Util.need_sudo(path):
@@ -1003,29 +1576,128 @@ class Util:
         else:
             Util.execute(f'cp {src_dir}/* {dest_dir}', show_cmd=True, show_duration=True)
 
+    # Sync all files under src_dir to dest_dir, and return the relative paths of updated files.
+    # Files are compared by size and mtime first, and by md5 only if they differ.
+    # Like copy_file(), <HOST_NAME>-<name> in src_dir overrides <name>, and <name>.bk keeps the replaced file
+    # if need_bk. Files are copied in parallel in process, and all copies under sudo paths share one sudo call.
+    @staticmethod
+    def sync_tree(src_dir, dest_dir, need_bk=True, max_workers=0, show_cmd=False):
+        if not os.path.exists(src_dir):
+            Util.warning(src_dir + ' does not exist')
+            return []
+
+        src_files = Util._scan_tree(src_dir)
+        host_prefix = Util.HOST_NAME + '-'
+        for rel_path in list(src_files):
+            dir_name, name = os.path.split(rel_path)
+            if name.startswith(host_prefix):
+                src_files[os.path.join(dir_name, name[len(host_prefix) :])] = src_files.pop(rel_path)
+        if os.path.exists(dest_dir):
+            dest_files = Util._scan_tree(dest_dir)
+        else:
+            dest_files = {}
+
+        def _get_copies(rel_path):
+            src_path, src_stat = src_files[rel_path]
+            dest_path = os.path.join(dest_dir, rel_path)
+            copies = []
+            if rel_path in dest_files:
+                dest_stat = dest_files[rel_path][1]
+                if dest_stat.st_size != src_stat.st_size:
+                    has_update = True
+                elif dest_stat.st_mtime_ns == src_stat.st_mtime_ns:
+                    has_update = False
+                else:
+                    has_update = Util.get_md5(dest_path) != Util.get_md5(src_path)
+                if need_bk and (has_update or rel_path + '.bk' not in dest_files):
+                    copies.append((dest_path, dest_path + '.bk'))
+            else:
+                has_update = True
+            if has_update:
+                copies.append((src_path, dest_path))
+            return rel_path, has_update, copies
+
+        if not max_workers:
+            max_workers = Util.CPU_COUNT
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            results = list(executor.map(_get_copies, sorted(src_files)))
+
+            copies = [copy for _, _, tmp_copies in results for copy in tmp_copies]
+            if Util.need_sudo(dest_dir):
+                Util._sudo_copy(copies, show_cmd=show_cmd)
+            else:
+                # .bk must be made before its file is replaced, so copies of the same file stay in one task
+                list(executor.map(Util._copy, [tmp_copies for _, _, tmp_copies in results if tmp_copies]))
+
+        updates = [rel_path for rel_path, has_update, _ in results if has_update]
+        if show_cmd:
+            Util.info('Synced %s files from %s to %s' % (len(updates), src_dir, dest_dir))
+        return updates
+
+    @staticmethod
+    # {relative path: (path, stat)} of all files under dir_path, with a single stat per file
+    def _scan_tree(dir_path, rel_dir=''):
+        files = {}
+        with os.scandir(os.path.join(dir_path, rel_dir)) as entries:
+            for entry in entries:
+                rel_path = os.path.join(rel_dir, entry.name)
+                if entry.is_dir():
+                    files.update(Util._scan_tree(dir_path, rel_path))
+                elif entry.is_file():
+                    files[rel_path] = (entry.path, entry.stat())
+        return files
+
+    @staticmethod
+    # Copy with metadata through a temporary file, so dest is replaced atomically
+    def _copy(copies):
+        for src_path, dest_path in copies:
+            Util.ensure_dir(os.path.dirname(dest_path))
+            tmp_path = '%s.%s.tmp' % (dest_path, uuid.uuid4())
+            shutil.copy2(src_path, tmp_path)
+            os.replace(tmp_path, dest_path)
+
+    @staticmethod
+    # Run all copies as one privileged shell script
+    def _sudo_copy(copies, show_cmd=False):
+        if not copies:
+            return
+        lines = ['set -e']
+        for src_path, dest_path in copies:
+            tmp_path = '%s.%s.tmp' % (dest_path, uuid.uuid4())
+            lines.append(
+                'mkdir -p %s && cp -pf %s %s && mv -f %s %s'
+                % (
+                    shlex.quote(os.path.dirname(dest_path)),
+                    shlex.quote(src_path),
+                    shlex.quote(tmp_path),
+                    shlex.quote(tmp_path),
+                    shlex.quote(dest_path),
+                )
+            )
+        if show_cmd:
+            Util.cmd('sudo sh -s <<< %s copies' % len(copies))
+        process = subprocess.Popen(['sudo', 'sh', '-s'], stdin=subprocess.PIPE, encoding='utf8')
+        process.communicate('\n'.join(lines) + '\n')
+        if process.returncode:
+            Util.error('Failed to copy %s files with sudo' % len(copies))
+
     @staticmethod
     # committer date, instead of author date
     def get_working_dir_date():
-        return (
-            Util.execute('git log -1 --date=format:"%Y%m%d" --format="%cd"', show_cmd=False, return_out=True)[1]
-            .rstrip('\n')
-            .rstrip('\r')
-        )
+        return GitRepoInfo().date
 
     @staticmethod
     def get_working_dir_hash():
-        cmd = 'git rev-list --reverse HEAD -1'
-        _, out = Util.execute(cmd, show_cmd=False, return_out=True)
-        return out.rstrip('\n').rstrip('\r')
+        return GitRepoInfo().hash
 
     @staticmethod
     def get_working_dir_rev():
-        cmd = 'git rev-list --count HEAD'
-        _, out = Util.execute(cmd, show_cmd=False, return_out=True)
-        return out.rstrip('\n').rstrip('\r')
+        return GitRepoInfo().rev
 
     @staticmethod
-    def get_repo_rev(branch='master'):
+    def get_repo_rev(branch='master', commit_graph=False):
+        if commit_graph:
+            Util.ensure_commit_graph()
         cmd = 'git rev-list --count HEAD origin/%s' % branch
         _, out = Util.execute(cmd, show_cmd=False, return_out=True)
         return out.rstrip('\n').rstrip('\r')
@@ -1037,7 +1709,42 @@ class Util:
         return out.split('\n')
 
     @staticmethod
-    def set_mesa(dir, rev=0, type='iris'):
+    # Same hashes as get_repo_hashes(), but read from git one at a time instead of being held in memory together
+    def iter_repo_hashes(branch='master', commit_graph=False):
+        if commit_graph:
+            Util.ensure_commit_graph()
+        cmd = ['git', 'rev-list', '--reverse', 'HEAD', 'origin/%s' % branch]
+        process = subprocess.Popen(cmd, stdout=subprocess.PIPE, encoding='utf8')
+        try:
+            for line in process.stdout:
+                yield line.rstrip('\n').rstrip('\r')
+        finally:
+            # The consumer may stop early, so don't leave git running
+            if process.poll() is None:
+                process.kill()
+            process.stdout.close()
+            process.wait()
+        if process.returncode:
+            Util.error('Failed to execute command [%s]' % ' '.join(cmd))
+
+    @staticmethod
+    # Make sure the repo in cwd has a commit-graph, which lets git count and walk commits without parsing every
+    # commit object. verify: also check an existing commit-graph, and write it again if it's broken
+    def ensure_commit_graph(verify=False):
+        _, out = Util.execute('git rev-parse --git-path objects/info', show_cmd=False, return_out=True)
+        info_dir = out.rstrip('\n').rstrip('\r')
+        has_commit_graph = os.path.exists('%s/commit-graph' % info_dir) or os.path.exists(
+            '%s/commit-graphs/commit-graph-chain' % info_dir
+        )
+        if has_commit_graph and verify:
+            ret, _ = Util.execute('git commit-graph verify', show_cmd=False, exit_on_error=False, fail_file=False)
+            has_commit_graph = not ret
+        if not has_commit_graph:
+            Util.execute('git commit-graph write --reachable', show_cmd=False, fail_file=False)
+
+    @staticmethod
+    # dedup: share the files of Mesa builds in dir through BackupStore
+    def set_mesa(dir, rev=0, type='iris', dedup=False):
         if rev == 'system':
             # Util.ensure_pkg('mesa-vulkan-drivers')
             rev_name = 'system'
@@ -1045,6 +1752,8 @@ class Util:
         else:
             rev_name, rev = Util.get_backup_dir(dir, rev)
             mesa_dir = '%s/%s' % (dir, rev_name)
+            if dedup:
+                BackupStore.get().ingest(mesa_dir)
             Util.set_env('LD_LIBRARY_PATH', '%s/lib:%s/lib/x86_64-linux-gnu' % (mesa_dir, mesa_dir), verbose=True)
             if type == 'i965':
                 Util.set_env('LIBGL_DRIVERS_PATH', '%s/lib/dri' % mesa_dir, verbose=True)
@@ -1060,9 +1769,10 @@ class Util:
 
     @staticmethod
     def cal_backup_dir(rev=0):
+        repo_info = GitRepoInfo()
         if not rev:
-            rev = Util.get_working_dir_rev()
-        return '%s-%s-%s' % (Util.get_working_dir_date(), rev, Util.get_working_dir_hash())
+            rev = repo_info.rev
+        return '%s-%s-%s' % (repo_info.date, rev, repo_info.hash)
 
     @staticmethod
     def get_python_ver():
@@ -1102,28 +1812,41 @@ class Util:
             return date_string  # Return original if parsing fails
 
     @staticmethod
+    # Return name, driver_date, driver_ver, device_id and vendor_id of the primary GPU, see HostInventory
     def get_gpu_info():
-        name = ''
-        driver_date = ''
-        driver_ver = ''
-        device_id = ''
-        vendor_id = ''
+        gpus = HostInventory.get().gpus
+        if gpus:
+            return tuple(gpus[0])
+        return tuple(GpuInfo('', '', '', '', ''))
 
-        if Util.HOST_OS == Util.LINUX:
+    @staticmethod
+    # Return GpuInfo of all GPUs, the primary one first
+    def _probe_gpus():
+        gpus = []
+        if Util.HOST_OS == Util.LINUX and os.path.isdir('%s/sys/bus/pci/devices' % Util.SYSFS_ROOT):
+            gpus = Util._probe_gpus_sysfs()
+        elif Util.HOST_OS == Util.LINUX:
             # Util.ensure_pkg('mesa-utils')
-            _, out = Util.execute('lspci -nn | grep VGA', return_out=True, log_file='')
-            match = re.search(r': (.*) \[.*:(.*)\]', out)
-            if match:
+            _, out = Util.execute('lspci -nn | grep VGA', return_out=True, log_file='', exit_on_error=False)
+            mesa_ver = None
+            for line in out.splitlines():
+                match = re.search(r': (.*) \[.*:(.*)\]', line)
+                if not match:
+                    continue
                 name = match.group(1)
                 device_id = match.group(2)
                 if 'NVIDIA' in name:
-                    _, driver_ver = Util.execute('nvidia-smi |grep Driver', return_out=True)
-                    match = re.search(r'Driver Version: (\d+.\d+)', driver_ver)
+                    _, out = Util.execute('nvidia-smi |grep Driver', return_out=True)
+                    match = re.search(r'Driver Version: (\d+.\d+)', out)
+                    driver_ver = match.group(1) if match else out
                 else:
-                    _, driver_ver = Util.execute('glxinfo | grep \'OpenGL version\'', return_out=True)
-                    match = re.search('(Mesa.*)', driver_ver)
-                if match:
-                    driver_ver = match.group(1)
+                    # glxinfo reports the Mesa in use, which is the same for all GPUs
+                    if mesa_ver is None:
+                        _, out = Util.execute('glxinfo | grep \'OpenGL version\'', return_out=True)
+                        match = re.search('(Mesa.*)', out)
+                        mesa_ver = match.group(1) if match else out
+                    driver_ver = mesa_ver
+                gpus.append(GpuInfo(name, '', driver_ver, device_id, ''))
         elif Util.HOST_OS == Util.WINDOWS:
             # Query all video controllers to find hardware GPUs and software fallbacks
             # First try enabled ones, then all if needed for software adapters
@@ -1132,7 +1855,7 @@ class Util:
                 lines = Util.execute(cmd, show_cmd=False, return_out=True)[1].split('\n')
             except Exception as e:
                 Util.warning(f'Failed to get GPU info via CIM: {e}')
-                return name, driver_date, driver_ver, device_id, vendor_id
+                return gpus
 
             # Collect all GPUs first, then prioritize hardware over software
             all_gpus = []
@@ -1177,65 +1900,141 @@ class Util:
             # 1. Hardware GPUs (highest priority)
             # 2. Basic Display/Render Adapters
             # 3. Remote Display Adapters (last resort)
-            selected_gpu = None
-
-            # First, look for hardware GPUs
-            for gpu in all_gpus:
-                if Util._is_hardware_gpu(gpu):
-                    selected_gpu = gpu
-                    break
-
-            # If no hardware GPU found, look for Basic Display/Render software adapters
-            if not selected_gpu:
+            for is_gpu in [Util._is_hardware_gpu, Util._is_software_gpu, Util._is_remote_display_gpu]:
                 for gpu in all_gpus:
-                    if Util._is_software_gpu(gpu):
-                        selected_gpu = gpu
-                        break
+                    if is_gpu(gpu):
+                        gpus.append(Util._get_windows_gpu_info(gpu))
 
-            # If still no GPU found, accept Remote Display Adapter as last resort
-            if not selected_gpu:
-                for gpu in all_gpus:
-                    if Util._is_remote_display_gpu(gpu):
-                        selected_gpu = gpu
-                        break
+            if not gpus:
+                # No GPU found, return WARP info as fallback
+                gpus.append(GpuInfo('Microsoft Basic Render Driver', '', '', '008c', '1414'))
+        return gpus
 
-            # Extract information from selected GPU
-            if selected_gpu:
-                name = selected_gpu.get('Name', '')
-                driver_date = selected_gpu.get('DriverDate', '')
-                driver_ver = selected_gpu.get('DriverVersion', '')
-                pnp_device_id = selected_gpu.get('PNPDeviceID', '')
-
-                # Extract device and vendor IDs
-                # For hardware GPUs, parse from PNPDeviceID
-                if pnp_device_id and pnp_device_id[0:3] != 'SWD':
-                    try:
-                        device_match = re.search('DEV_(.{4})', pnp_device_id)
-                        vendor_match = re.search('VEN_(.{4})', pnp_device_id)
-                        if device_match and vendor_match:
-                            device_id = device_match.group(1)
-                            vendor_id = vendor_match.group(1)
-                    except Exception as e:
-                        Util.warning(f'Failed to parse PNPDeviceID {pnp_device_id}: {e}')
-
-                # For specific Microsoft software adapters, set correct device IDs
-                elif 'Microsoft' in name and (
-                    'Basic Render' in name or 'Basic Display' in name or 'Remote Display' in name
-                ):
-                    vendor_id = '1414'  # Microsoft vendor ID
-                    if 'Basic Render' in name:
-                        device_id = '008c'
-                    elif 'Basic Display' in name:
-                        device_id = '00ff'  # Microsoft Basic Display Adapter
-                    elif 'Remote Display' in name:
-                        device_id = '008c'  # Same as Basic Render Driver when used as fallback
+    @staticmethod
+    # Probe GPUs from sysfs under root without running any command, so that it also works without a display. Display
+    # controllers of any PCI subclass (VGA, 3D and others) are reported, the boot VGA device first.
+    def _probe_gpus_sysfs(root=None):
+        if root is None:
+            root = Util.SYSFS_ROOT
+        devices = []
+        for device_dir in sorted(glob.glob('%s/sys/bus/pci/devices/*' % root)):
+            try:
+                if not Util._read_sysfs(device_dir, 'class').startswith('0x03'):
+                    continue
+                vendor_id = Util._read_sysfs(device_dir, 'vendor')[2:]
+                device_id = Util._read_sysfs(device_dir, 'device')[2:]
+            except OSError:
+                continue
+            try:
+                boot_vga = Util._read_sysfs(device_dir, 'boot_vga') == '1'
+            except OSError:
+                boot_vga = False
+            driver = ''
+            if os.path.islink('%s/driver' % device_dir):
+                driver = os.path.basename(os.readlink('%s/driver' % device_dir))
+            devices.append((not boot_vga, vendor_id, device_id, driver))
+        devices.sort(key=lambda device: device[0])
+
+        names = Util._get_pci_names(root, [device[1:3] for device in devices])
+        gpus = []
+        mesa_ver = None
+        for _, vendor_id, device_id, driver in devices:
+            if driver == 'nvidia':
+                try:
+                    driver_ver = Util._read_sysfs('%s/sys/module/nvidia' % root, 'version')
+                except OSError:
+                    driver_ver = ''
             else:
-                # No GPU found, return WARP info as fallback
-                name = 'Microsoft Basic Render Driver'
-                vendor_id = '1414'
-                device_id = '008c'
+                # The Mesa in use is the same for all GPUs
+                if mesa_ver is None:
+                    mesa_ver = Util._get_mesa_ver(root)
+                driver_ver = mesa_ver
+            gpus.append(GpuInfo(names[(vendor_id, device_id)], '', driver_ver, device_id, vendor_id))
+        return gpus
+
+    @staticmethod
+    def _read_sysfs(dir, name):
+        with open('%s/%s' % (dir, name)) as f:
+            return f.read().strip()
+
+    @staticmethod
+    # Map (vendor_id, device_id) in ids to names like "Intel Corporation TigerLake-LP GT2 [Iris Xe Graphics]" in
+    # pci.ids, which is what lspci shows. Ids not in pci.ids are named by themselves.
+    def _get_pci_names(root, ids):
+        names = dict((id, '%s:%s' % id) for id in ids)
+        vendor_ids = set(vendor_id for vendor_id, _ in ids)
+        for file_path in Util.PCI_IDS_FILES:
+            if not os.path.exists(root + file_path):
+                continue
+            with open(root + file_path, encoding='utf-8', errors='replace') as f:
+                vendor_id = None
+                for line in f:
+                    if not line.startswith('\t'):
+                        match = re.match(r'([0-9a-f]{4})\s+(.*)', line)
+                        vendor_id = match.group(1) if match and match.group(1) in vendor_ids else None
+                        vendor_name = match.group(2) if match else ''
+                    elif vendor_id and not line.startswith('\t\t'):
+                        match = re.match(r'\t([0-9a-f]{4})\s+(.*)', line)
+                        if match and (vendor_id, match.group(1)) in names:
+                            names[(vendor_id, match.group(1))] = '%s %s' % (vendor_name, match.group(2).strip())
+            break
+        return names
+
+    @staticmethod
+    # Read the version of Mesa from its library, looking in LD_LIBRARY_PATH first like the loader does, and return it
+    # like "Mesa 24.0.1" as glxinfo does
+    def _get_mesa_ver(root):
+        lib_dirs = [lib_dir for lib_dir in os.getenv('LD_LIBRARY_PATH', '').split(os.pathsep) if lib_dir]
+        for lib_dir in lib_dirs + Util.MESA_LIB_DIRS:
+            lib_root = root if lib_dir in Util.MESA_LIB_DIRS else ''
+            for lib_name in Util.MESA_LIB_NAMES:
+                for file_path in glob.glob('%s%s/%s' % (lib_root, lib_dir, lib_name)):
+                    # mmap only pages in what the search goes through, instead of reading tens of MB
+                    version = None
+                    with open(file_path, 'rb') as f:
+                        try:
+                            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                                match = re.search(rb'Mesa (\d+\.\d+\.\d+[\w.+~-]*)', data)
+                                if match:
+                                    version = bytes(match.group(1)).decode()
+                        except ValueError:
+                            # Empty file
+                            pass
+                    if version:
+                        return 'Mesa %s' % version
+        return ''
+
+    @staticmethod
+    def _get_windows_gpu_info(gpu):
+        name = gpu.get('Name', '')
+        driver_date = gpu.get('DriverDate', '')
+        driver_ver = gpu.get('DriverVersion', '')
+        pnp_device_id = gpu.get('PNPDeviceID', '')
+        device_id = ''
+        vendor_id = ''
+
+        # Extract device and vendor IDs
+        # For hardware GPUs, parse from PNPDeviceID
+        if pnp_device_id and pnp_device_id[0:3] != 'SWD':
+            try:
+                device_match = re.search('DEV_(.{4})', pnp_device_id)
+                vendor_match = re.search('VEN_(.{4})', pnp_device_id)
+                if device_match and vendor_match:
+                    device_id = device_match.group(1)
+                    vendor_id = vendor_match.group(1)
+            except Exception as e:
+                Util.warning(f'Failed to parse PNPDeviceID {pnp_device_id}: {e}')
 
-        return name, driver_date, driver_ver, device_id, vendor_id
+        # For specific Microsoft software adapters, set correct device IDs
+        elif 'Microsoft' in name and ('Basic Render' in name or 'Basic Display' in name or 'Remote Display' in name):
+            vendor_id = '1414'  # Microsoft vendor ID
+            if 'Basic Render' in name:
+                device_id = '008c'
+            elif 'Basic Display' in name:
+                device_id = '00ff'  # Microsoft Basic Display Adapter
+            elif 'Remote Display' in name:
+                device_id = '008c'  # Same as Basic Render Driver when used as fallback
+        return GpuInfo(name, driver_date, driver_ver, device_id, vendor_id)
 
     @staticmethod
     def _is_hardware_gpu(gpu_info):
@@ -1301,6 +2100,10 @@ class Util:
 
     @staticmethod
     def get_os_info():
+        return HostInventory.get().os_ver
+
+    @staticmethod
+    def _probe_os_ver():
         if Util.HOST_OS == Util.WINDOWS:
             _, output = Util.execute('ver', show_cmd=False, return_out=True)
             match = re.search(r'\[Version (.*)\]', output)
@@ -1309,159 +2112,94 @@ class Util:
             ver = platform.version()
         return ver
 
+    @staticmethod
+    def _probe_cpu_name():
+        if Util.HOST_OS in [Util.LINUX, Util.CHROMEOS]:
+            try:
+                with open('/proc/cpuinfo') as f:
+                    match = re.search(r'^model name\s*:\s*(.*)$', f.read(), re.MULTILINE)
+                    if match:
+                        return match.group(1).strip()
+            except OSError:
+                pass
+        return platform.processor()
+
     @staticmethod
     def get_intel_gpu_series_type(gpu_device_id: str):
-        lowercase_id = gpu_device_id.lower()
-        masked_id = '%s00' % lowercase_id[:-2]
-        # Gen 12
-        if masked_id == '0x9a00':
-            return 'tigerlake'
-        elif masked_id == '0x4c00':
-            return 'rocketlake'
-        elif masked_id == '0x4900':
-            return 'dg1'
-        elif masked_id == '0x4600':
-            return 'alderlake'
-        elif masked_id in {'0x4f00', '0x5600'}:
-            return 'alchemist'
-        elif masked_id == '0xa700':
-            return 'raptorlake'
-        elif masked_id == '0x7d00':
-            return 'meteorlake'
-        # Gen 11
-        elif masked_id == '0x8a00':
-            return 'icelake'
-        elif masked_id == '0x4500':
-            return 'elkhartlake'
-        elif masked_id == '0x4e00':
-            return 'jasperlake'
-        # Gen 10
-        elif masked_id == '0x5a00':
-            if lowercase_id in {'0x5a84', '0x5a85'}:
-                return 'apollolake'
-            return 'cannonlake'
-        # Gen 9
-        elif masked_id == '0x1900':
-            return 'skylake'
-        elif masked_id == '0x1a00':
-            return 'apollolake'
-        elif masked_id == '0x3100':
-            return 'geminilake'
-        elif masked_id == '0x5900':
-            if lowercase_id == '0x591c':
-                return 'amberlake'
-            return 'kabylake'
-        elif masked_id == '0x8700':
-            if lowercase_id == '0x87c0':
-                return 'kabylake'
-            elif lowercase_id == '0x87ca':
-                return 'coffeelake'
-            return None
-        elif masked_id == '0x3e00':
-            if lowercase_id in {'0x3ea0', '0x3ea1', '0x3ea2', '0x3ea3', '0x3ea4'}:
-                return 'whiskeylake'
-            return 'coffeelake'
-        elif masked_id == '0x9b00':
-            return 'cometlake'
-        # Gen 8
-        elif masked_id == '0x2200':
-            return 'cherrytrail'
-        elif masked_id == '0x1600':
-            return 'broadwell'
-        # Gen 7
-        elif masked_id == '0x0f00':
-            return 'baytrail'
-        elif masked_id in {'0x0400', '0x0c00', '0x0d00'}:
-            return 'haswell'
-        elif masked_id == '0x0a00':
-            # Gen 9
-            if gpu_device_id == '0x0a84':
-                return 'apollolake'
-            return 'haswell'
-        # Gen 6
-        elif masked_id == '0x0100':
-            # Gen 7
-            if lowercase_id in {'0x0152', '0x0156', '0x015a', '0x0162', '0x0166', '0x016a'}:
-                return 'ivybridge'
-            # Gen 7
-            elif lowercase_id in {'0x0155', '0x0157'}:
-                return 'baytrail'
-            return 'sandybridge'
-        # Gen 5
-        elif masked_id == '0x0000':
-            return 'ironlake'
-        # Gen 4
-        elif masked_id == '0x2900':
-            return 'broadwater'
-        elif masked_id == '0x2a00':
-            if lowercase_id in {'0x2a02', '0x2a12'}:
-                return 'broadwater'
-            elif lowercase_id == '0x2a42':
-                return 'eaglelake'
-            return None
-        elif masked_id == '0x2e00':
-            return 'eaglelake'
-        return None
+        return Util.get_gpu_series_type(gpu_device_id, Util.VENDOR_ID_INTEL)
 
     @staticmethod
     def get_intel_gpu_generation(gpu_device_id: str):
-        series_type = Util.get_intel_gpu_series_type(gpu_device_id)
-        if series_type in {'tigerlake', 'rocketlake', 'dg1', 'alderlake', 'alchemist', 'raptorlake', 'meteorlake'}:
-            return 12
-        elif series_type in {'icelake', 'elkhartlake', 'jasperlake'}:
-            return 11
-        elif series_type == 'cannonlake':
-            return 10
-        elif series_type in {
-            'apollolake',
-            'skylake',
-            'geminilake',
-            'kabylake',
-            'amberlake',
-            'coffeelake',
-            'whiskeylake',
-            'cometlake',
-        }:
-            return 9
-        elif series_type in {'cherrytrail', 'broadwell'}:
-            return 8
-        elif series_type in {'baytrail', 'haswell', 'ivybridge'}:
-            return 7
-        elif series_type == 'sandybridge':
-            return 6
-        elif series_type == 'ironlake':
-            return 5
-        elif series_type in {'broadwater', 'eaglelake'}:
-            return 4
-        return None
+        return Util.get_gpu_generation(gpu_device_id, Util.VENDOR_ID_INTEL)
 
     @staticmethod
-    def get_backup_dir(backup_dir, rev):
-        if rev == 'latest':
-            rev = -1
-            rev_name = ''
-            files = os.listdir(backup_dir)
-            for file in files:
-                match = re.match('%s$' % Util.BACKUP_PATTERN, file)
-                if match:
-                    tmp_rev = int(match.group(2))
-                    if tmp_rev > rev:
-                        rev_name = file
-                        rev = tmp_rev
+    # vendor_id is like '8086' or '0x8086', and GPUs of vendors not in GPU_DEVICE_IDS have no series type
+    def get_gpu_series_type(gpu_device_id: str, vendor_id: str = '8086'):
+        device_ids = Util.GPU_DEVICE_IDS.get(Util._format_vendor_id(vendor_id))
+        if not device_ids:
+            return None
+        exact_ids, masked_ids = device_ids
+        lowercase_id = gpu_device_id.lower()
+        if lowercase_id in exact_ids:
+            return exact_ids[lowercase_id]
+        return masked_ids.get('%s00' % lowercase_id[:-2])
+
+    @staticmethod
+    def get_gpu_generation(gpu_device_id: str, vendor_id: str = '8086'):
+        return Util.INTEL_GPU_GENERATIONS.get(Util.get_gpu_series_type(gpu_device_id, vendor_id))
 
-            return (rev_name, rev)
+    @staticmethod
+    # Label many GPUs at once, e.g., columns of benchmark results, and return [(series_type, generation)]. Each GPU
+    # is a device id of Intel like '0x9a49', or a (vendor_id, device_id) pair. Each distinct GPU is looked up once.
+    def classify_gpus(gpus):
+        gpus = [(Util.VENDOR_ID_INTEL, gpu) if isinstance(gpu, str) else tuple(gpu) for gpu in gpus]
+        labels = {}
+        for vendor_id, device_id in set(gpus):
+            series_type = Util.get_gpu_series_type(device_id, vendor_id)
+            labels[(vendor_id, device_id)] = (series_type, Util.INTEL_GPU_GENERATIONS.get(series_type))
+        return [labels[gpu] for gpu in gpus]
+
+    @staticmethod
+    # Extend or override the GPU tables with a json file like {"exact": {"0x5a84": "apollolake"}, "masked":
+    # {"0x9a00": "tigerlake"}, "generations": {"tigerlake": 12}}, where "exact" and "masked" are of Intel. Other
+    # vendors are in "vendors", like {"vendors": {"8086": {"exact": {...}, "masked": {...}}}}.
+    def load_gpu_table(file_path):
+        table = Util.load_json(file_path)
+        vendors = dict((Util._format_vendor_id(key), value) for key, value in table.get('vendors', {}).items())
+        vendors.setdefault(Util.VENDOR_ID_INTEL, {})
+        for name in ['exact', 'masked']:
+            vendors[Util.VENDOR_ID_INTEL].setdefault(name, {}).update(table.get(name, {}))
+        for vendor_id, vendor_table in vendors.items():
+            exact_ids, masked_ids = Util.GPU_DEVICE_IDS.setdefault(vendor_id, ({}, {}))
+            exact_ids.update((key.lower(), value) for key, value in vendor_table.get('exact', {}).items())
+            masked_ids.update((key.lower(), value) for key, value in vendor_table.get('masked', {}).items())
+        Util.INTEL_GPU_GENERATIONS.update(table.get('generations', {}))
+
+    @staticmethod
+    def _format_vendor_id(vendor_id):
+        vendor_id = vendor_id.lower()
+        if vendor_id.startswith('0x'):
+            vendor_id = vendor_id[2:]
+        return vendor_id
+
+    @staticmethod
+    # rev is 'latest' (or 0) for the backup with the largest rev
+    def get_backup_dir(backup_dir, rev):
+        catalog = BackupCatalog.get(backup_dir)
+        if rev == 'latest' or not rev:
+            backup = catalog.latest()
+            if not backup:
+                return ('', -1)
+            return (backup[0], int(backup[2]))
         else:
-            files = os.listdir(backup_dir)
-            for file in files:
-                match = re.search(Util.BACKUP_PATTERN, file)
-                if match:
-                    rev_name = file
-                    return (rev_name, rev)
-            else:
+            backup = catalog.find(rev)
+            if not backup:
                 Util.error('Could not find backup %s' % rev)
+            return (backup[0], rev)
 
     @staticmethod
-    def ssh_cmd(server, cmd=''):
+    # share: run over the shared master connection of server. Transfers that want their own TCP stream disable it.
+    def ssh_cmd(server, cmd='', share=True):
         new_cmd = 'ssh'
         # Use shared key by default for the authentication if the key exists.
         if os.path.exists(Util.SSH_KEY):
@@ -1470,6 +2208,8 @@ class Util:
         # Issue: https://github.com/PowerShell/Win32-OpenSSH/issues/1334
         if Util.HOST_OS == Util.WINDOWS:
             new_cmd += ' -x'
+        if share:
+            new_cmd += Util._ssh_control_options(server)
         new_cmd += f' wp@{server} {cmd}'
         return new_cmd
 
@@ -1479,11 +2219,90 @@ class Util:
         # Use shared key by default for the authentication if the key exists.
         if os.path.exists(Util.SSH_KEY):
             cmd += f' -i {Util.SSH_KEY}'
+        match = re.match('wp@([^:]+):', src) or re.match('wp@([^:]+):', dest)
+        if match:
+            cmd += Util._ssh_control_options(match.group(1))
         cmd += f' {src} {dest}'
         return cmd
 
+    @staticmethod
+    # Options to run ssh and scp over the shared connection to server, if ensure_ssh_master() found it running.
+    # Otherwise no options are returned and commands connect directly. This only reads the state, so building a
+    # command has no side effects. If the master has exited since, ssh falls back to a direct connection.
+    def _ssh_control_options(server):
+        if Util.HOST_OS == Util.WINDOWS or not Util.SSH_CONTROL_PERSIST:
+            return ''
+
+        with Util.ssh_lock:
+            _, running = Util.ssh_masters.get(server, (0, False))
+        if not running:
+            return ''
+        return ' -o ControlMaster=no -o ControlPath=%s/%%C' % Util.SSH_CONTROL_DIR
+
+    @staticmethod
+    # Start the shared connection to server if it is not running, before running ssh or scp commands to it. The
+    # master connection is kept for SSH_CONTROL_PERSIST seconds after the last command, so later commands skip the
+    # handshake. Commands never become the master themselves, as a master started by a command with return_out would
+    # keep its pipes open in background, and communicate() would wait for it. Win32-OpenSSH doesn't support
+    # connection sharing.
+    def ensure_ssh_master(server):
+        if Util.HOST_OS == Util.WINDOWS or not Util.SSH_CONTROL_PERSIST:
+            return
+
+        with Util.ssh_lock:
+            lock = Util.ssh_locks.setdefault(server, threading.Lock())
+        # Only callers for the same server wait here, for at most SSH_CONNECT_TIMEOUT. The master is checked again
+        # once in a while, as it exits after being idle for SSH_CONTROL_PERSIST seconds.
+        with lock:
+            checked_time, _ = Util.ssh_masters.get(server, (0, False))
+            if time.time() - checked_time > Util.SSH_CONTROL_PERSIST / 2:
+                running = Util._start_ssh_master(server)
+                with Util.ssh_lock:
+                    Util.ssh_masters[server] = (time.time(), running)
+
+    @staticmethod
+    # Return True if the master connection of server is running, starting it with no pipes attached if needed
+    def _start_ssh_master(server):
+        if not os.path.exists(Util.SSH_CONTROL_DIR):
+            os.makedirs(Util.SSH_CONTROL_DIR, mode=0o700)
+        cmd = ['ssh']
+        if os.path.exists(Util.SSH_KEY):
+            cmd += ['-i', Util.SSH_KEY]
+        cmd += ['-o', 'ControlPath=%s/%%C' % Util.SSH_CONTROL_DIR]
+        check_cmd = cmd + ['-O', 'check', f'wp@{server}']
+        if not subprocess.call(check_cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL):
+            return True
+
+        # BatchMode fails instead of prompting for a password or an unknown host key
+        cmd += [
+            '-o',
+            'ControlMaster=yes',
+            '-o',
+            'ControlPersist=%s' % Util.SSH_CONTROL_PERSIST,
+            '-o',
+            'BatchMode=yes',
+            '-o',
+            'ConnectTimeout=%s' % Util.SSH_CONNECT_TIMEOUT,
+            '-f',
+            '-N',
+            f'wp@{server}',
+        ]
+        subprocess.call(cmd, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        return not subprocess.call(check_cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    @staticmethod
+    # Stop the shared connection to server
+    def ssh_close(server):
+        if Util.HOST_OS == Util.WINDOWS or not Util.SSH_CONTROL_PERSIST:
+            return
+        cmd = ['ssh', '-o', 'ControlPath=%s/%%C' % Util.SSH_CONTROL_DIR, '-O', 'exit', f'wp@{server}']
+        subprocess.call(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        with Util.ssh_lock:
+            Util.ssh_masters.pop(server, None)
+
     @staticmethod
     def check_server_backup(relative_path, rev_file):
+        Util.ensure_ssh_master(Util.BACKUP_SERVER)
         cmd = Util.ssh_cmd(Util.BACKUP_SERVER, f'ls {Util.LINUX_BACKUP_DIR}/{Util.HOST_OS}/{relative_path}/{rev_file}')
         ret, _ = Util.execute(cmd, exit_on_error=False)
         if ret:
@@ -1492,11 +2311,27 @@ class Util:
             return True
 
     @staticmethod
-    def get_server_backup(relative_path, rev='latest'):
-        cmd = Util.ssh_cmd(Util.BACKUP_SERVER, f'ls -1t /workspace/backup/{Util.HOST_OS}/{relative_path}/ | head -1')
+    # stream: pipe the archive from server into an in-process extractor instead of scp and tar, and only keep the
+    # archive if keep_archive
+    # jobs: download the archive with Util.get_server_file over jobs connections instead of scp
+    # dedup: share the files of the backup with other backups through BackupStore
+    def get_server_backup(relative_path, rev='latest', stream=False, keep_archive=True, jobs=0, dedup=False):
+        Util.ensure_ssh_master(Util.BACKUP_SERVER)
         shell = Util.HOST_OS == Util.LINUX
-        _, out = Util.execute(cmd, return_out=True, shell=shell, exit_on_error=False)
-        match = re.search('%s' % Util.BACKUP_PATTERN, out)
+        if rev == 'latest' or not rev:
+            cmd = Util.ssh_cmd(
+                Util.BACKUP_SERVER, f'ls -1t /workspace/backup/{Util.HOST_OS}/{relative_path}/ | head -1'
+            )
+            _, out = Util.execute(cmd, return_out=True, shell=shell, exit_on_error=False)
+            match = re.search('%s' % Util.BACKUP_PATTERN, out)
+        else:
+            cmd = Util.ssh_cmd(Util.BACKUP_SERVER, f'ls -1 /workspace/backup/{Util.HOST_OS}/{relative_path}/')
+            _, out = Util.execute(cmd, return_out=True, shell=shell, exit_on_error=False)
+            # The last one, e.g., the newest build, if there are multiple backups of rev
+            matches = [match for match in re.finditer(Util.BACKUP_PATTERN, out) if match.group(2) == str(rev)]
+            if not matches:
+                Util.error('Could not find backup %s in %s on %s' % (rev, relative_path, Util.BACKUP_SERVER))
+            match = matches[-1]
         rev_name = match.group(0)
         date = match.group(1)
         rev = match.group(2)
@@ -1508,13 +2343,35 @@ class Util:
 
         local_backup_dir = '%s/%s' % (Util.BACKUP_DIR, relative_path)
         Util.ensure_dir(local_backup_dir)
+        if stream:
+            if not os.path.exists('%s/%s' % (local_backup_dir, rev_name)):
+                Util.extract_backup(
+                    f'/workspace/backup/{Util.HOST_OS}/{relative_path}/{rev_file}',
+                    local_backup_dir,
+                    rev_name,
+                    keep_archive=keep_archive,
+                    dedup=dedup,
+                )
+            # Free if the backup was deduplicated while it was extracted
+            if dedup:
+                BackupStore.get().ingest('%s/%s' % (local_backup_dir, rev_name))
+            return rev_name, date, rev
+
         if not os.path.exists('%s/%s' % (local_backup_dir, rev_name)) and not os.path.exists(
             '%s/%s' % (local_backup_dir, rev_file)
         ):
-            cmd = Util.scp_cmd(
-                f'wp@{Util.BACKUP_SERVER}:/workspace/backup/{Util.HOST_OS}/{relative_path}/{rev_file}', local_backup_dir
-            )
-            Util.execute(cmd)
+            if jobs:
+                Util.get_server_file(
+                    f'/workspace/backup/{Util.HOST_OS}/{relative_path}/{rev_file}',
+                    '%s/%s' % (local_backup_dir, rev_file),
+                    jobs=jobs,
+                )
+            else:
+                cmd = Util.scp_cmd(
+                    f'wp@{Util.BACKUP_SERVER}:/workspace/backup/{Util.HOST_OS}/{relative_path}/{rev_file}',
+                    local_backup_dir,
+                )
+                Util.execute(cmd)
         if not os.path.exists('%s/%s' % (local_backup_dir, rev_name)):
             if Util.HOST_OS == Util.LINUX:
                 Util.chdir(local_backup_dir)
@@ -1528,19 +2385,234 @@ class Util:
                     shutil.move('%s/%s' % (Util.WORKSPACE_DIR, rev_name), '%s/' % local_backup_dir)
                 except Exception as e:
                     Util.warning(f'shutil.move: {e}')
+        if dedup:
+            BackupStore.get().ingest('%s/%s' % (local_backup_dir, rev_name))
         return rev_name, date, rev
 
+    @staticmethod
+    # Extract archive_path (.tar.gz or .zip) on BACKUP_SERVER as local_backup_dir/rev_name, reading the local copy of
+    # the archive instead if it's already in local_backup_dir. A .tar.gz is extracted while it's being downloaded,
+    # while a .zip has its directory at the end, so it's downloaded first. Either way, the backup is extracted to a
+    # temporary dir and then renamed, so local_backup_dir/rev_name never holds a partial backup.
+    # dedup: link the files of a .tar.gz with BackupStore while they are extracted
+    def extract_backup(archive_path, local_backup_dir, rev_name, keep_archive=True, dedup=False):
+        rev_file = os.path.basename(archive_path)
+        local_archive_file = '%s/%s' % (local_backup_dir, rev_file)
+        # to workaround filename too long issue on Windows, extract to workspace first
+        if Util.HOST_OS == Util.WINDOWS:
+            tmp_root_dir = Util.WORKSPACE_DIR
+        else:
+            tmp_root_dir = local_backup_dir
+        tmp_dir = '%s/.%s-%s' % (tmp_root_dir, rev_name, uuid.uuid4())
+        part_file = '%s.%s.part' % (local_archive_file, uuid.uuid4())
+
+        process = None
+        if os.path.exists(local_archive_file):
+            src = open(local_archive_file, 'rb')
+            keep_archive = False
+        else:
+            Util.info('Stream %s:%s' % (Util.BACKUP_SERVER, archive_path))
+            Util.ensure_ssh_master(Util.BACKUP_SERVER)
+            cmd = Util.ssh_cmd(Util.BACKUP_SERVER, 'cat %s' % archive_path)
+            process = subprocess.Popen(cmd, shell=Util.HOST_OS != Util.WINDOWS, stdout=subprocess.PIPE)
+            src = process.stdout
+        # Only a download is written to disk, as the archive itself is read otherwise
+        if process and (keep_archive or rev_file.endswith('.zip')):
+            archive = open(part_file, 'wb')
+        else:
+            archive = None
+
+        try:
+            reader = _TeeReader(src, archive)
+            if rev_file.endswith('.zip'):
+                if archive:
+                    reader.drain()
+                    archive.close()
+                with zipfile.ZipFile(part_file if archive else local_archive_file) as zip_file:
+                    zip_file.extractall(tmp_dir)
+            else:
+                # Keep the behavior of "tar zxf", e.g., symbolic links and permissions, on Python with tar filters
+                kwargs = {'filter': 'fully_trusted'} if hasattr(tarfile, 'fully_trusted_filter') else {}
+                try:
+                    with tarfile.open(fileobj=reader, mode='r|gz') as tar_file:
+                        if dedup:
+                            saved = BackupStore.get().extract(tar_file, tmp_dir, **kwargs)
+                            Util.info('Deduplicated %s, saved %.1f MB' % (rev_name, saved / 1024 / 1024))
+                        else:
+                            tar_file.extractall(tmp_dir, **kwargs)
+                except tarfile.TarError as e:
+                    if process and process.wait():
+                        Util.error('Failed to download %s:%s' % (Util.BACKUP_SERVER, archive_path))
+                    Util.error('Failed to extract %s: %s' % (archive_path, e))
+                reader.drain()
+            if process and process.wait():
+                Util.error('Failed to download %s:%s' % (Util.BACKUP_SERVER, archive_path))
+
+            # tar.gz has rev_name as its top dir, while zip doesn't. Unlike shutil.move(), the rename never moves the
+            # backup into an existing dir, so if others extracted it in the meantime, it fails and theirs is used.
+            # tmp_root_dir is on the same volume on Windows too.
+            backup_dir = '%s/%s' % (local_backup_dir, rev_name)
+            if os.listdir(tmp_dir) == [rev_name]:
+                extracted_dir = '%s/%s' % (tmp_dir, rev_name)
+            else:
+                extracted_dir = tmp_dir
+            try:
+                os.rename(extracted_dir, backup_dir)
+            except OSError:
+                if not os.path.isdir(backup_dir):
+                    raise
+                Util.info('%s was extracted by others' % backup_dir)
+            else:
+                if dedup and not rev_file.endswith('.zip'):
+                    BackupStore.get().record(backup_dir)
+            if archive:
+                archive.close()
+                if keep_archive:
+                    os.replace(part_file, local_archive_file)
+        finally:
+            src.close()
+            if process and process.poll() is None:
+                process.kill()
+                process.wait()
+            if archive:
+                archive.close()
+            Util.ensure_nofile(part_file)
+            Util.ensure_nodir(tmp_dir)
+
+    @staticmethod
+    # Download remote_path on server to local_file by chunk_size byte ranges over jobs ssh connections. Progress is
+    # kept in local_file.part.json next to local_file.part, so an interrupted download resumes from where each chunk
+    # stopped, and every chunk is checked against its sha256 on server before local_file is renamed into place.
+    def get_server_file(remote_path, local_file, server=None, jobs=4, chunk_size=0, retries=2):
+        if not server:
+            server = Util.BACKUP_SERVER
+        if not chunk_size:
+            chunk_size = Util.SERVER_FILE_CHUNK_SIZE
+        Util.ensure_ssh_master(server)
+        shell = Util.HOST_OS != Util.WINDOWS
+
+        def remote(cmd):
+            _, out = Util.execute(
+                Util.ssh_cmd(server, '"%s"' % cmd), return_out=True, show_cmd=False, shell=shell, exit_on_error=False
+            )
+            return out.strip()
+
+        # dd reads the byte range without going through a pipe
+        def dd(offset, length):
+            return 'dd if=%s bs=1M skip=%d count=%d iflag=skip_bytes,count_bytes status=none' % (
+                remote_path,
+                offset,
+                length,
+            )
+
+        out = remote('stat -c %%s:%%Y %s' % remote_path)
+        match = re.match(r'(\d+):(\d+)$', out)
+        if not match:
+            Util.error('Could not find %s:%s' % (server, remote_path))
+        size = int(match.group(1))
+        mtime = int(match.group(2))
+
+        part_file = '%s.part' % local_file
+        manifest_file = '%s.part.json' % local_file
+        manifest = None
+        if os.path.exists(part_file) and os.path.exists(manifest_file):
+            try:
+                manifest = Util.load_json(manifest_file)
+            except ValueError:
+                pass
+        if not manifest or [manifest.get(key) for key in ('path', 'size', 'mtime', 'chunk_size')] != [
+            remote_path,
+            size,
+            mtime,
+            chunk_size,
+        ]:
+            manifest = {'path': remote_path, 'size': size, 'mtime': mtime, 'chunk_size': chunk_size, 'chunks': {}}
+            Util.ensure_dir(os.path.dirname(os.path.abspath(local_file)))
+            with open(part_file, 'wb') as f:
+                f.truncate(size)
+        chunks = manifest['chunks']
+        lock = threading.Lock()
+
+        def save(index, progress):
+            with lock:
+                chunks[str(index)] = progress
+                Util.dump_json(manifest_file, manifest, atomic=True)
+
+        def fetch(index):
+            offset = index * chunk_size
+            length = min(chunk_size, size - offset)
+            progress = chunks.get(str(index), {'done': 0})
+            if progress.get('sha256'):
+                return
+
+            for _ in range(retries + 1):
+                done = progress['done']
+                sha256 = hashlib.sha256()
+                with open(part_file, 'r+b') as f:
+                    # Rehash what an earlier run has written to continue from there
+                    f.seek(offset)
+                    while f.tell() < offset + done:
+                        sha256.update(f.read(min(1024 * 1024, offset + done - f.tell())))
+
+                    process = subprocess.Popen(
+                        Util.ssh_cmd(server, '"%s"' % dd(offset + done, length - done), share=False),
+                        shell=shell,
+                        stdout=subprocess.PIPE,
+                    )
+                    saved = time.time()
+                    for data in iter(lambda: process.stdout.read(1024 * 1024), b''):
+                        f.write(data)
+                        sha256.update(data)
+                        done += len(data)
+                        if time.time() - saved > 5:
+                            f.flush()
+                            save(index, {'done': done})
+                            saved = time.time()
+                    process.stdout.close()
+                    process.wait()
+                progress = {'done': done}
+                save(index, progress)
+                if done < length:
+                    continue
+
+                remote_sha256 = remote('%s | sha256sum' % dd(offset, length)).split(' ')[0]
+                if sha256.hexdigest() == remote_sha256:
+                    save(index, {'done': done, 'sha256': remote_sha256})
+                    return
+                Util.warning('Chunk %d of %s:%s is corrupted, download it again' % (index, server, remote_path))
+                progress = {'done': 0}
+            Util.error('Failed to download chunk %d of %s:%s' % (index, server, remote_path))
+
+        count = max(1, (size + chunk_size - 1) // chunk_size)
+        Util.info('Download %s:%s in %d chunks' % (server, remote_path, count))
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+            for future in [executor.submit(fetch, index) for index in range(count)]:
+                future.result()
+
+        os.replace(part_file, local_file)
+        Util.ensure_nofile(manifest_file)
+
+    @staticmethod
+    # Return {(st_dev, st_ino): st_size} of files in dir, so that hardlinked files are counted once
+    def _get_tree_inodes(dir):
+        inodes = {}
+        for dir_path, _, file_names in os.walk(dir):
+            for file_name in file_names:
+                stat = os.lstat(os.path.join(dir_path, file_name))
+                inodes[(stat.st_dev, stat.st_ino)] = stat.st_size
+        return inodes
+
     @staticmethod
     def get_local_backup(relative_path, rev='latest'):
         local_backup_dir = '%s/%s' % (Util.BACKUP_DIR, relative_path)
-        for file_name in sorted(os.listdir(local_backup_dir), reverse=True):
-            match = re.match('%s$' % Util.BACKUP_PATTERN, file_name)
-            if match:
-                rev_name = file_name
-                date = match.group(1)
-                rev = match.group(2)
-                break
-        return rev_name, date, rev
+        catalog = BackupCatalog.get(local_backup_dir)
+        if rev == 'latest':
+            backup = catalog.latest()
+        else:
+            backup = catalog.find(rev)
+        if not backup:
+            Util.error('Could not find backup %s in %s' % (rev, local_backup_dir))
+        return backup
 
     @staticmethod
     def impossible():
@@ -1568,35 +2640,43 @@ class Util:
     # if HOST_OS == WINDOWS:
     #    PYTHON = 'python.exe'  # Use default installed python on Windows
     PYTHON_MAJOR = sys.version_info.major
-    if HOST_OS == LINUX:
-        result = subprocess.check_output(['cat', '/etc/lsb-release']).decode('utf-8')
-        if re.search(CHROMEOS, result):
-            HOST_OS = CHROMEOS
-
-    if HOST_OS in [CHROMEOS]:
-        HOST_OS_RELEASE = platform.platform()
-    elif HOST_OS == DARWIN:
-        HOST_OS_RELEASE = platform.mac_ver()[0]
-    elif HOST_OS == LINUX:
-        if PYTHON_MAJOR == 3:
-            HOST_OS_RELEASE = distro.id()
-            HOST_OS_DESCRIPTION = distro.name()
-        else:
-            HOST_OS_RELEASE = platform.linux_distribution()[1]
-            HOST_OS_DESCRIPTION = '%s %s' % (platform.linux_distribution()[0], platform.linux_distribution()[1])
-    elif HOST_OS == WINDOWS:
-        # platform.version() will read 19041 instead of 19042 on Windows 10
-        if PYTHON_MAJOR == 3:
-            HOST_OS_RELEASE = subprocess.check_output(['cmd', '/c', 'ver']).decode('utf-8').split('\n')[1].rstrip('\r')
-        else:
-            HOST_OS_RELEASE = subprocess.check_output(['cmd', '/c', 'ver']).split('\n')[1].rstrip('\r')
+    if HOST_OS == LINUX and os.path.exists('/etc/lsb-release'):
+        with open('/etc/lsb-release') as f:
+            if re.search(CHROMEOS, f.read()):
+                HOST_OS = CHROMEOS
+
+    # Below host facts are computed on first access and cached on disk until next boot, see _HostFact
+    @_HostFact
+    def HOST_OS_RELEASE():
+        if Util.HOST_OS in [Util.CHROMEOS]:
+            return platform.platform()
+        elif Util.HOST_OS == Util.DARWIN:
+            return platform.mac_ver()[0]
+        elif Util.HOST_OS == Util.LINUX:
+            return distro.id()
+        elif Util.HOST_OS == Util.WINDOWS:
+            # platform.version() will read 19041 instead of 19042 on Windows 10
+            return subprocess.check_output(['cmd', '/c', 'ver']).decode('utf-8').split('\n')[1].rstrip('\r')
+        return ''
+
+    @_HostFact
+    def HOST_OS_DESCRIPTION():
+        if Util.HOST_OS == Util.LINUX:
+            return distro.name()
+        return ''
+
+    @_HostFact
+    def HOST_NAME():
+        return socket.gethostname()
+
+    @_HostFact
+    def CPU_COUNT():
+        return multiprocessing.cpu_count()
 
-    HOST_NAME = socket.gethostname()
     if HOST_OS == WINDOWS:
         USER_NAME = os.getenv('USERNAME')
     else:
         USER_NAME = os.getenv('USER')
-    CPU_COUNT = multiprocessing.cpu_count()
 
     if HOST_OS == WINDOWS:
         ROOT_DIR = 'd:'
@@ -1623,6 +2703,176 @@ class Util:
     # which user logs in.
     SSH_DIR = format_slash.__func__(f'{HOME_DIR}/.ssh')
     SSH_KEY = format_slash.__func__(f'{SSH_DIR}/id_rsa_common')
+    # Share one connection per server among ssh and scp commands, see ensure_ssh_master(). 0 to disable
+    SSH_CONTROL_DIR = format_slash.__func__(f'{SSH_DIR}/control')
+    SSH_CONTROL_PERSIST = 600
+    SSH_CONNECT_TIMEOUT = 10
+    SERVER_FILE_CHUNK_SIZE = 256 * 1024 * 1024
+    BACKUP_CACHE_SIZE = 100 * 1024 * 1024 * 1024
+    # Max entries of Md5Cache, least recently used ones are dropped first
+    MD5_CACHE_SIZE = 100000
+    # Coarsest mtime resolution of the filesystems we hash on (FAT has 2s), in ns
+    MD5_CACHE_MTIME_GRANULARITY = 2 * 1000 * 1000 * 1000
+
+    # target_os -> browser_name -> candidate paths of BrowserPathResolver, where '*' matches any browser_name
+    BROWSER_PATHS = {
+        CHROMEOS: {'*': ['/opt/google/chrome/chrome']},
+        DARWIN: {
+            'chrome': ['{chromium_dir}/{out_dir}/Release/Chromium.app/Contents/MacOS/Chromium'],
+            'chrome_canary': ['/Applications/Google Chrome Canary.app/Contents/MacOS/Google Chrome Canary'],
+            'chrome_dev': ['/Applications/Google Chrome Dev.app/Contents/MacOS/Google Chrome Dev'],
+            'chrome_beta': ['/Applications/Google Chrome Beta.app/Contents/MacOS/Google Chrome Beta'],
+            'chrome_stable': ['/Applications/Google Chrome.app/Contents/MacOS/Google Chrome'],
+        },
+        LINUX: {
+            'chrome': ['{chromium_dir}/{out_dir}/Release/chrome'],
+            'chrome_canary': ['/usr/bin/google-chrome-unstable'],
+            'chrome_dev': ['/usr/bin/google-chrome-unstable'],
+            'chrome_beta': ['/usr/bin/google-chrome-beta'],
+            'chrome_stable': ['/usr/bin/google-chrome-stable'],
+        },
+        WINDOWS: {
+            'chrome': ['{chromium_dir}/{out_dir}/Release/chrome.exe'],
+            'chrome_canary': [
+                '{localappdata_dir}/Google/Chrome SxS/Application/chrome.exe',
+                '{appdata_dir}/../Local/Google/Chrome SxS/Application/chrome.exe',
+            ],
+            'chrome_dev': ['{programfiles_dir}/Google/Chrome Dev/Application/chrome.exe'],
+            'chrome_beta': ['{programfiles_dir}/Google/Chrome Beta/Application/chrome.exe'],
+            'chrome_stable': ['{programfiles_dir}/Google/Chrome/Application/chrome.exe'],
+            'firefox_nightly': ['{programfiles_dir}/Nightly/firefox.exe'],
+            'edge': [
+                'C:/Program Files (x86)/Microsoft/Edge/Application/msedge.exe',
+                'C:/windows/systemapps/Microsoft.MicrosoftEdge_8wekyb3d8bbwe/MicrosoftEdge.exe',
+            ],
+        },
+    }
+
+    BENCHMARK_CPUS_PER_SESSION = 4
+    BENCHMARK_SESSIONS_PER_GPU = 2
+
+    # Root of sysfs and library dirs to probe GPUs from, which can be a fake one for tests
+    SYSFS_ROOT = ''
+    PCI_IDS_FILES = ['/usr/share/misc/pci.ids', '/usr/share/hwdata/pci.ids']
+    MESA_LIB_DIRS = ['/usr/lib/x86_64-linux-gnu', '/usr/lib64', '/usr/lib']
+    # Libraries with the version string of Mesa, libgallium since Mesa 24.1 and the DRI megadriver before it
+    MESA_LIB_NAMES = ['libgallium-*.so', 'dri/*_dri.so']
+
+    # Files whose change means a driver update, which invalidates the cache of HostInventory
+    INVENTORY_DRIVER_FILES = {
+        LINUX: [
+            '/proc/driver/nvidia/version',
+            '/usr/lib/x86_64-linux-gnu/dri',
+            '/usr/lib/x86_64-linux-gnu/libGLX_mesa.so.0',
+            '/usr/lib/x86_64-linux-gnu/libvulkan_intel.so',
+        ],
+        WINDOWS: ['C:/Windows/System32/DriverStore/FileRepository'],
+    }
+
+    # Intel GPU device id -> series type. Ids in INTEL_GPU_EXACT_IDS take precedence over the masked ones, whose last
+    # two hex digits are 00. None marks masked ids without a default series.
+    INTEL_GPU_EXACT_IDS = {
+        '0x5a84': 'apollolake',
+        '0x5a85': 'apollolake',
+        '0x591c': 'amberlake',
+        '0x87c0': 'kabylake',
+        '0x87ca': 'coffeelake',
+        '0x3ea0': 'whiskeylake',
+        '0x3ea1': 'whiskeylake',
+        '0x3ea2': 'whiskeylake',
+        '0x3ea3': 'whiskeylake',
+        '0x3ea4': 'whiskeylake',
+        '0x0a84': 'apollolake',
+        '0x0152': 'ivybridge',
+        '0x0156': 'ivybridge',
+        '0x015a': 'ivybridge',
+        '0x0162': 'ivybridge',
+        '0x0166': 'ivybridge',
+        '0x016a': 'ivybridge',
+        '0x0155': 'baytrail',
+        '0x0157': 'baytrail',
+        '0x2a02': 'broadwater',
+        '0x2a12': 'broadwater',
+        '0x2a42': 'eaglelake',
+    }
+    INTEL_GPU_MASKED_IDS = {
+        # Gen 12
+        '0x9a00': 'tigerlake',
+        '0x4c00': 'rocketlake',
+        '0x4900': 'dg1',
+        '0x4600': 'alderlake',
+        '0x4f00': 'alchemist',
+        '0x5600': 'alchemist',
+        '0xa700': 'raptorlake',
+        '0x7d00': 'meteorlake',
+        # Gen 11
+        '0x8a00': 'icelake',
+        '0x4500': 'elkhartlake',
+        '0x4e00': 'jasperlake',
+        # Gen 10
+        '0x5a00': 'cannonlake',
+        # Gen 9
+        '0x1900': 'skylake',
+        '0x1a00': 'apollolake',
+        '0x3100': 'geminilake',
+        '0x5900': 'kabylake',
+        '0x8700': None,
+        '0x3e00': 'coffeelake',
+        '0x9b00': 'cometlake',
+        # Gen 8
+        '0x2200': 'cherrytrail',
+        '0x1600': 'broadwell',
+        # Gen 7
+        '0x0f00': 'baytrail',
+        '0x0400': 'haswell',
+        '0x0c00': 'haswell',
+        '0x0d00': 'haswell',
+        '0x0a00': 'haswell',
+        # Gen 6
+        '0x0100': 'sandybridge',
+        # Gen 5
+        '0x0000': 'ironlake',
+        # Gen 4
+        '0x2900': 'broadwater',
+        '0x2a00': None,
+        '0x2e00': 'eaglelake',
+    }
+    # vendor id -> (exact ids, masked ids) of the series types of its GPUs
+    GPU_DEVICE_IDS = {'8086': (INTEL_GPU_EXACT_IDS, INTEL_GPU_MASKED_IDS)}
+    INTEL_GPU_GENERATIONS = {
+        'tigerlake': 12,
+        'rocketlake': 12,
+        'dg1': 12,
+        'alderlake': 12,
+        'alchemist': 12,
+        'raptorlake': 12,
+        'meteorlake': 12,
+        'icelake': 11,
+        'elkhartlake': 11,
+        'jasperlake': 11,
+        'cannonlake': 10,
+        'apollolake': 9,
+        'skylake': 9,
+        'geminilake': 9,
+        'kabylake': 9,
+        'amberlake': 9,
+        'coffeelake': 9,
+        'whiskeylake': 9,
+        'cometlake': 9,
+        'cherrytrail': 8,
+        'broadwell': 8,
+        'baytrail': 7,
+        'haswell': 7,
+        'ivybridge': 7,
+        'sandybridge': 6,
+        'ironlake': 5,
+        'broadwater': 4,
+        'eaglelake': 4,
+    }
+    # server -> (time of last check, whether its master is running)
+    ssh_masters = {}
+    ssh_locks = {}
+    ssh_lock = threading.Lock()
 
     # contrib
     # folder name: [display name, path]
@@ -1670,6 +2920,799 @@ class Util:
     VENDOR_ID_NVIDIA = '10de'
     VENDOR_ID_QUALCOMM = 'QCOM'
 
+    # log, see set_log()
+    LOG_LEVELS = {
+        'debug': logging.DEBUG,
+        'strace': logging.DEBUG,
+        'cmd': logging.INFO,
+        'info': logging.INFO,
+        'warning': logging.WARNING,
+        'error': logging.ERROR,
+    }
+    LOG_BUFFER_LINES = 1000
+    log_level = logging.DEBUG
+    log_logger = None
+    log_buffer = None
+    log_lock = threading.Lock()
+
+
+class Md5Cache:
+    """md5 of files keyed on (path, size, mtime_ns, inode), persisted in ScriptRepo.IGNORE_MD5_FILE at exit.
+
+    Entries are kept in least recently used order and capped at Util.MD5_CACHE_SIZE. Only entries used in this run
+    are checked at exit, so saving doesn't stat the whole cache.
+    """
+
+    entries = None
+    # paths used in this run, in the order of use
+    used = None
+    dirty = False
+    lock = threading.Lock()
+
+    @staticmethod
+    def get(path, stat):
+        path = os.path.abspath(path)
+        with Md5Cache.lock:
+            entry = Md5Cache._load().get(path)
+            if entry and entry[:3] == [stat.st_size, stat.st_mtime_ns, stat.st_ino]:
+                Md5Cache._use(path)
+                return entry[3]
+        return None
+
+    @staticmethod
+    def set(path, stat, md5):
+        path = os.path.abspath(path)
+        with Md5Cache.lock:
+            Md5Cache._load()[path] = [stat.st_size, stat.st_mtime_ns, stat.st_ino, md5]
+            Md5Cache._use(path)
+            Md5Cache.dirty = True
+
+    @staticmethod
+    def save():
+        with Md5Cache.lock:
+            if not Md5Cache.dirty:
+                return
+            # Merge with entries saved by other processes in the meantime, and move the ones used in this run to the
+            # end. A file modified within the mtime granularity of now may change again without a new mtime, as
+            # racy-git puts it, so such entries are not saved and get hashed again next time.
+            entries = Md5Cache._read()
+            racy_mtime = time.time_ns() - Util.MD5_CACHE_MTIME_GRANULARITY
+            for path in Md5Cache.used:
+                entry = entries.pop(path, None)
+                entry = Md5Cache.entries.get(path, entry)
+                if entry and entry[1] < racy_mtime and os.path.exists(path):
+                    entries[path] = entry
+            for path in list(entries)[: max(len(entries) - Util.MD5_CACHE_SIZE, 0)]:
+                del entries[path]
+            try:
+                Util.dump_json(ScriptRepo.IGNORE_MD5_FILE, entries, indent=None, atomic=True)
+            except OSError as e:
+                Util.warning('Failed to save md5 cache: %s' % e)
+            Md5Cache.dirty = False
+
+    @staticmethod
+    def _load():
+        if Md5Cache.entries is None:
+            Md5Cache.entries = Md5Cache._read()
+            Md5Cache.used = {}
+            atexit.register(Md5Cache.save)
+        return Md5Cache.entries
+
+    @staticmethod
+    def _use(path):
+        Md5Cache.used.pop(path, None)
+        Md5Cache.used[path] = None
+
+    @staticmethod
+    def _read():
+        if os.path.exists(ScriptRepo.IGNORE_MD5_FILE):
+            try:
+                return Util.load_json(ScriptRepo.IGNORE_MD5_FILE)
+            except ValueError:
+                pass
+        return {}
+
+
+class GitRepoInfo:
+    """date (committer date in %Y%m%d), rev (commit count), hash and branch of HEAD of a git repo.
+
+    HEAD is resolved by reading the git dir directly, and date and rev are memoized per (repo, HEAD hash) in memory
+    and in ScriptRepo.IGNORE_GIT_INFO_FILE, so git only runs when HEAD of the repo moved.
+    """
+
+    cache = None
+    lock = threading.Lock()
+
+    def __init__(self, repo_dir='.'):
+        self.repo_dir = Util.format_slash(os.path.abspath(repo_dir))
+        self.hash, self.branch = self._read_head()
+
+        key = '%s@%s' % (self.repo_dir, self.hash)
+        with GitRepoInfo.lock:
+            cache = GitRepoInfo._load_cache()
+            if key not in cache:
+                cache[key] = self._query()
+                try:
+                    Util.dump_json(ScriptRepo.IGNORE_GIT_INFO_FILE, cache, indent=None, atomic=True)
+                except OSError:
+                    pass
+            self.date, self.rev = cache[key]
+
+    # return (hash, branch) of HEAD, where branch is '' if HEAD is detached
+    def _read_head(self):
+        git_dir = self._find_git_dir()
+        if not git_dir:
+            # Not a repo we can read, so let git resolve HEAD
+            return self._git('rev-parse HEAD'), ''
+
+        # Worktrees keep refs in the common dir
+        common_dir = git_dir
+        if os.path.exists('%s/commondir' % git_dir):
+            with open('%s/commondir' % git_dir) as f:
+                common_dir = os.path.normpath(os.path.join(git_dir, f.read().strip()))
+
+        with open('%s/HEAD' % git_dir) as f:
+            head = f.read().strip()
+        if not head.startswith('ref: '):
+            return head, ''
+
+        ref = head[len('ref: ') :]
+        branch = ref.replace('refs/heads/', '', 1)
+        for ref_dir in [git_dir, common_dir]:
+            ref_file = '%s/%s' % (ref_dir, ref)
+            if os.path.exists(ref_file):
+                with open(ref_file) as f:
+                    return f.read().strip(), branch
+        packed_refs_file = '%s/packed-refs' % common_dir
+        if os.path.exists(packed_refs_file):
+            with open(packed_refs_file) as f:
+                for line in f:
+                    fields = line.split()
+                    if len(fields) == 2 and fields[1] == ref:
+                        return fields[0], branch
+        return self._git('rev-parse HEAD'), branch
+
+    def _find_git_dir(self):
+        dir_path = self.repo_dir
+        while True:
+            git_path = '%s/.git' % dir_path
+            if os.path.isdir(git_path):
+                return git_path
+            if os.path.isfile(git_path):
+                # Submodules and worktrees have a .git file pointing to the real git dir
+                with open(git_path) as f:
+                    match = re.match('gitdir: (.*)', f.read().strip())
+                if match:
+                    return os.path.normpath(os.path.join(dir_path, match.group(1)))
+                return ''
+            parent_dir = os.path.dirname(dir_path)
+            if parent_dir == dir_path:
+                return ''
+            dir_path = parent_dir
+
+    # return [date, rev] of HEAD
+    def _query(self):
+        date = self._git('log -1 --date=format:%%Y%%m%%d --format=%%cd %s' % self.hash)
+        rev = self._git('rev-list --count %s' % self.hash)
+        return [date, rev]
+
+    def _git(self, args):
+        cmd = ['git', '-C', self.repo_dir] + args.split()
+        process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, encoding='utf8')
+        out, _ = process.communicate()
+        if process.returncode:
+            Util.error('Failed to execute command [%s]' % ' '.join(cmd))
+        return out.rstrip('\n').rstrip('\r')
+
+    @staticmethod
+    def _load_cache():
+        if GitRepoInfo.cache is None:
+            GitRepoInfo.cache = {}
+            if os.path.exists(ScriptRepo.IGNORE_GIT_INFO_FILE):
+                try:
+                    GitRepoInfo.cache = Util.load_json(ScriptRepo.IGNORE_GIT_INFO_FILE)
+                except ValueError:
+                    pass
+        return GitRepoInfo.cache
+
+
+class _TeeReader:
+    """File-like reader of src, which also writes what is read to file if it's not None."""
+
+    def __init__(self, src, file=None):
+        self.src = src
+        self.file = file
+
+    def read(self, size=-1):
+        data = self.src.read(size)
+        if self.file:
+            self.file.write(data)
+        return data
+
+    # Read the rest of src, e.g., the padding after the end of a tar archive
+    def drain(self, chunk_size=1024 * 1024):
+        while self.read(chunk_size):
+            pass
+
+
+class BackupCatalog:
+    """Backups named <date>-<rev>-<hash> in a directory, indexed by rev.
+
+    The directory is listed once into a sorted index, which is rebuilt only when the mtime of the directory changes.
+    Lookups return (rev_name, date, rev) like Util.get_local_backup(), or None if there is no such backup.
+    """
+
+    PATTERN = re.compile('%s$' % Util.BACKUP_PATTERN)
+
+    catalogs = {}
+    lock = threading.Lock()
+
+    @staticmethod
+    def get(backup_dir):
+        backup_dir = os.path.abspath(backup_dir)
+        with BackupCatalog.lock:
+            if backup_dir not in BackupCatalog.catalogs:
+                BackupCatalog.catalogs[backup_dir] = BackupCatalog(backup_dir)
+            return BackupCatalog.catalogs[backup_dir]
+
+    def __init__(self, backup_dir):
+        self.backup_dir = backup_dir
+        self.mtime_ns = None
+        # (revs, backups), where revs are sorted and backups[i] is (rev_name, date, rev) of revs[i]. They are
+        # replaced together, so a lookup always reads a matching pair even if another thread rebuilds them.
+        self.index = ([], [])
+        self._lock = threading.Lock()
+
+    def latest(self):
+        _, backups = self._update()
+        if backups:
+            return backups[-1]
+        return None
+
+    def find(self, rev):
+        revs, backups = self._update()
+        return BackupCatalog._find(revs, backups, int(rev))
+
+    # The backup whose rev is closest to rev, the smaller one if there is a tie
+    def nearest(self, rev):
+        revs, backups = self._update()
+        if not revs:
+            return None
+        rev = int(rev)
+        index = bisect.bisect_left(revs, rev)
+        if index == len(revs):
+            return backups[-1]
+        if index > 0 and rev - revs[index - 1] <= revs[index] - rev:
+            return BackupCatalog._find(revs, backups, revs[index - 1])
+        return BackupCatalog._find(revs, backups, revs[index])
+
+    @staticmethod
+    def _find(revs, backups, rev):
+        # The last one, e.g., the newest build, if there are multiple backups of rev
+        index = bisect.bisect_right(revs, rev) - 1
+        if index >= 0 and revs[index] == rev:
+            return backups[index]
+        return None
+
+    # return the current (revs, backups), rebuilt first if the directory changed
+    def _update(self):
+        mtime_ns = os.stat(self.backup_dir).st_mtime_ns
+        with self._lock:
+            if mtime_ns == self.mtime_ns:
+                return self.index
+
+            backups = []
+            for file_name in os.listdir(self.backup_dir):
+                match = BackupCatalog.PATTERN.match(file_name)
+                if match and match.group(2):
+                    backups.append((int(match.group(2)), match.group(1), file_name, match.group(2)))
+            backups.sort()
+            revs = [backup[0] for backup in backups]
+            self.index = (revs, [(file_name, date, rev) for _, date, file_name, rev in backups])
+            self.mtime_ns = mtime_ns
+            return self.index
+
+
+class BackupStore:
+    """Content-addressed store of backup files, so that files shared by backups are kept only once on disk.
+
+    Each blob is <root>/<key[:2]>/<key>, where key is the md5 and mode of the file. A streamed tar.gz backup is
+    deduplicated while it's extracted by extract(), which hashes every file as it's written and links it with its
+    blob. Other backups are ingested after extraction by replacing their files with hardlinks to the blobs. Backups
+    keep their layout, so Util.get_local_backup() and BackupCatalog work on them as before. Ingested backups are
+    recorded in <root>/ingested.json with the inode of their dir, so that ingesting them again is free. As inodes
+    are reused, a file of the backup is also checked to be linked with the store, so that a backup extracted again
+    at the same path is ingested again. As files of a backup share inodes with other backups, backups must not be
+    modified in place.
+    """
+
+    store = None
+    lock = threading.Lock()
+
+    @staticmethod
+    def get():
+        with BackupStore.lock:
+            if not BackupStore.store:
+                BackupStore.store = BackupStore('%s/store' % Util.BACKUP_DIR)
+            return BackupStore.store
+
+    def __init__(self, root):
+        self.root = root
+        self.ingested_file = '%s/ingested.json' % root
+        self.ingested = None
+
+    def ingest(self, backup_dir):
+        backup_dir = os.path.abspath(backup_dir)
+        with BackupStore.lock:
+            self._load()
+            if self.ingested.get(backup_dir) == os.stat(backup_dir).st_ino and self._is_linked(backup_dir):
+                return
+
+        saved = 0
+        for dir_path, _, file_names in os.walk(backup_dir):
+            for file_name in file_names:
+                saved += self._ingest_file(os.path.join(dir_path, file_name))
+        Util.info('Deduplicated %s, saved %.1f MB' % (backup_dir, saved / 1024 / 1024))
+        self.record(backup_dir)
+
+    # Extract tar_file, e.g., a stream, to path like tar_file.extractall(), but write its regular files through
+    # add(), so that they are deduplicated without being read again. Return the bytes saved.
+    def extract(self, tar_file, path, **kwargs):
+        saved = 0
+        dirs = []
+        for member in tar_file:
+            file_path = os.path.join(path, member.name)
+            if member.isreg() and member.size:
+                os.makedirs(os.path.dirname(file_path), exist_ok=True)
+                saved += self.add(tar_file.extractfile(member), file_path, member.mode, member.mtime)
+            elif member.isdir():
+                # Like extractall(), attributes of dirs are set at last, as extracting files into them changes mtime
+                tar_file.extract(member, path, set_attrs=False, **kwargs)
+                dirs.append(member)
+            else:
+                tar_file.extract(member, path, **kwargs)
+        for member in reversed(dirs):
+            dir_path = os.path.join(path, member.name)
+            tar_file.chown(member, dir_path, False)
+            tar_file.utime(member, dir_path)
+            tar_file.chmod(member, dir_path)
+        return saved
+
+    # Write the content of f to file_path as a hardlink of its blob, hashing it on the way. Return the bytes saved.
+    def add(self, f, file_path, mode, mtime):
+        os.makedirs(self.root, exist_ok=True)
+        tmp_file = '%s/.%s' % (self.root, uuid.uuid4())
+        md5 = hashlib.md5()
+        size = 0
+        try:
+            with open(tmp_file, 'wb') as out:
+                for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                    md5.update(chunk)
+                    out.write(chunk)
+                    size += len(chunk)
+            os.chmod(tmp_file, mode & 0o7777)
+            os.utime(tmp_file, (mtime, mtime))
+            key = '%s-%o' % (md5.hexdigest(), mode & 0o7777)
+            blob = '%s/%s/%s' % (self.root, key[:2], key)
+            tmp_link = '%s.%s' % (file_path, uuid.uuid4())
+            try:
+                saved = size if self._link_blob(tmp_file, blob) else 0
+                # A later member of the same name replaces the file, as with "tar zxf"
+                os.link(blob, tmp_link)
+                os.replace(tmp_link, file_path)
+            except OSError as e:
+                # e.g., the store is on another file system
+                Util.warning('Could not deduplicate %s: %s' % (file_path, e))
+                Util.ensure_nofile(tmp_link)
+                os.replace(tmp_file, file_path)
+                saved = 0
+        finally:
+            Util.ensure_nofile(tmp_file)
+        return saved
+
+    # Record backup_dir as ingested
+    def record(self, backup_dir):
+        backup_dir = os.path.abspath(backup_dir)
+        with BackupStore.lock:
+            self._load()
+            self.ingested[backup_dir] = os.stat(backup_dir).st_ino
+            Util.dump_json(self.ingested_file, self.ingested, sort_keys=True, atomic=True)
+
+    # Remove blobs not linked by any backup, and forget backups that no longer exist
+    def gc(self):
+        if not os.path.exists(self.root):
+            return
+
+        freed = 0
+        for dir_path, _, file_names in os.walk(self.root):
+            if dir_path == self.root:
+                continue
+            for file_name in file_names:
+                blob = os.path.join(dir_path, file_name)
+                stat = os.stat(blob)
+                if stat.st_nlink == 1:
+                    os.remove(blob)
+                    freed += stat.st_size
+        with BackupStore.lock:
+            self._load()
+            for backup_dir in list(self.ingested):
+                if not os.path.exists(backup_dir):
+                    del self.ingested[backup_dir]
+            Util.dump_json(self.ingested_file, self.ingested, sort_keys=True, atomic=True)
+        Util.info('Freed %.1f MB in %s' % (freed / 1024 / 1024, self.root))
+
+    # Forget backup_dir, e.g., when it's removed
+    def forget(self, backup_dir):
+        backup_dir = os.path.abspath(backup_dir)
+        with BackupStore.lock:
+            self._load()
+            if self.ingested.pop(backup_dir, None) is not None:
+                Util.dump_json(self.ingested_file, self.ingested, sort_keys=True, atomic=True)
+
+    # Whether the first file of backup_dir which would be ingested has another link, e.g., its blob
+    def _is_linked(self, backup_dir):
+        for dir_path, _, file_names in os.walk(backup_dir):
+            for file_name in file_names:
+                file_path = os.path.join(dir_path, file_name)
+                if os.path.isfile(file_path) and not os.path.islink(file_path) and os.path.getsize(file_path):
+                    return os.stat(file_path).st_nlink > 1
+        return True
+
+    def _load(self):
+        if self.ingested is None:
+            self.ingested = {}
+            if os.path.exists(self.ingested_file):
+                ingested = Util.load_json(self.ingested_file)
+                # Backups recorded without their inode are ingested again
+                if isinstance(ingested, dict):
+                    self.ingested = ingested
+
+    # Link file_path with its blob, and return the bytes saved
+    def _ingest_file(self, file_path):
+        stat = os.lstat(file_path)
+        if not os.path.isfile(file_path) or os.path.islink(file_path) or not stat.st_size:
+            return 0
+
+        with open(file_path, 'rb') as f:
+            key = '%s-%o' % (Util._get_md5_from_file(f), stat.st_mode & 0o7777)
+        blob = '%s/%s/%s' % (self.root, key[:2], key)
+        try:
+            if not self._link_blob(file_path, blob):
+                return 0
+            if os.path.samefile(blob, file_path):
+                return 0
+            tmp_file = '%s.%s' % (file_path, uuid.uuid4())
+            os.link(blob, tmp_file)
+            os.replace(tmp_file, file_path)
+        except OSError as e:
+            # e.g., the store is on another file system
+            Util.warning('Could not deduplicate %s: %s' % (file_path, e))
+            return 0
+        return stat.st_size
+
+    # Make file_path the blob if there is no such blob yet, and return whether the blob already existed. Another
+    # thread or process may create the same blob in the meantime, and then the existing one is used.
+    def _link_blob(self, file_path, blob):
+        os.makedirs(os.path.dirname(blob), exist_ok=True)
+        try:
+            os.link(file_path, blob)
+        except FileExistsError:
+            return True
+        return False
+
+
+class BackupPrefetcher:
+    """Prefetch backups from BACKUP_SERVER while the current one is in use, e.g., the next midpoints of a bisect.
+
+    prefetch(revs) downloads and extracts backups of relative_path in jobs worker threads, and get(rev) returns
+    (rev_name, date, rev) like Util.get_server_backup(), waiting for the prefetch of rev if there is one. Extracted
+    backups are kept as an LRU cache in BACKUP_DIR/relative_path, where the least recently used ones are removed
+    once they take more than max_size bytes. Other arguments are passed to Util.get_server_backup().
+
+        with BackupPrefetcher('chromium') as prefetcher:
+            rev_name, date, rev = prefetcher.get(mid)
+            prefetcher.prefetch([(low + mid) // 2, (mid + high) // 2])
+    """
+
+    def __init__(self, relative_path, jobs=2, max_size=0, **kwargs):
+        self.relative_path = relative_path
+        self.local_backup_dir = '%s/%s' % (Util.BACKUP_DIR, relative_path)
+        self.max_size = max_size or Util.BACKUP_CACHE_SIZE
+        # Backups are extracted within the process, as "tar zxf" needs to chdir
+        self.kwargs = dict(kwargs, stream=True)
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=jobs)
+        self.futures = {}
+        # rev_name -> inodes of its files, as backups don't change once extracted
+        self.inodes = {}
+        self.used = set()
+        self.lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        for future in self.futures.values():
+            future.cancel()
+        self.executor.shutdown(wait=True)
+
+    def prefetch(self, revs):
+        with self.lock:
+            for rev in revs:
+                rev = str(rev)
+                if rev not in self.futures and not self._find(rev):
+                    self.futures[rev] = self.executor.submit(self._fetch, rev)
+
+    def get(self, rev):
+        rev = str(rev)
+        with self.lock:
+            future = self.futures.pop(rev, None)
+        backup = None
+        if future and not future.cancelled():
+            backup = future.result()
+            # e.g., removed by another process since it was prefetched
+            if not os.path.isdir('%s/%s' % (self.local_backup_dir, backup[0])):
+                backup = None
+        if not backup:
+            backup = self._find(rev) or self._fetch(rev)
+        with self.lock:
+            self.used = set([backup[0]])
+        self._touch(backup[0])
+        self.evict()
+        return backup
+
+    # Remove the least recently used backups until they take no more than max_size
+    def evict(self):
+        # Backups in use and backups being or already prefetched but not used yet are kept
+        with self.lock:
+            keep = set(self.used)
+            keep_revs = set(self.futures)
+
+        backups = []
+        for rev_name in os.listdir(self.local_backup_dir):
+            backup_dir = '%s/%s' % (self.local_backup_dir, rev_name)
+            match = BackupCatalog.PATTERN.match(rev_name)
+            if match and os.path.isdir(backup_dir):
+                if match.group(2) in keep_revs:
+                    keep.add(rev_name)
+                if rev_name not in self.inodes:
+                    self.inodes[rev_name] = Util._get_tree_inodes(backup_dir)
+                backups.append((os.stat(backup_dir).st_mtime, rev_name))
+        backups.sort()
+
+        # Files shared by backups through BackupStore take space only once, and are only freed with the last backup
+        # linking them
+        links = collections.Counter()
+        sizes = {}
+        for _, rev_name in backups:
+            links.update(self.inodes[rev_name].keys())
+            sizes.update(self.inodes[rev_name])
+        total_size = sum(sizes.values())
+
+        dedup = self.kwargs.get('dedup')
+        evicted = False
+        for _, rev_name in backups:
+            if total_size <= self.max_size:
+                break
+            if rev_name in keep:
+                continue
+            backup_dir = '%s/%s' % (self.local_backup_dir, rev_name)
+            Util.info('Evict backup %s' % backup_dir)
+            Util.ensure_nodir(backup_dir)
+            for suffix in ['.tar.gz', '.zip']:
+                Util.ensure_nofile('%s%s' % (backup_dir, suffix))
+            if dedup:
+                BackupStore.get().forget(backup_dir)
+            for inode, size in self.inodes.pop(rev_name).items():
+                links[inode] -= 1
+                if not links[inode]:
+                    total_size -= size
+            evicted = True
+        # The store still links the files of evicted backups
+        if dedup and evicted:
+            BackupStore.get().gc()
+
+    def _fetch(self, rev):
+        backup = Util.get_server_backup(self.relative_path, rev, **self.kwargs)
+        # Extraction keeps the mtime from the archive, while the LRU order is by the time of fetch and use
+        self._touch(backup[0])
+        return backup
+
+    def _find(self, rev):
+        if not os.path.exists(self.local_backup_dir):
+            return None
+        return BackupCatalog.get(self.local_backup_dir).find(rev)
+
+    def _touch(self, rev_name):
+        os.utime('%s/%s' % (self.local_backup_dir, rev_name))
+
+
+# script returns the metric of the page at url, and an exclusive job runs with nothing else running for timing
+BenchmarkJob = collections.namedtuple('BenchmarkJob', ['browser_name', 'url', 'script', 'exclusive'], defaults=[False])
+
+
+class _WebDriverSession:
+    __slots__ = ['driver', 'user_data_dir', 'uses']
+
+    def __init__(self, driver, user_data_dir):
+        self.driver = driver
+        self.user_data_dir = user_data_dir
+        self.uses = 0
+
+
+class WebDriverPool:
+    """Warm WebDriver sessions from Util.get_webdriver(), so that browser startup is paid once instead of per page.
+
+    Sessions are kept per (browser_name, browser_path, browser_options, webdriver_file, target_os), each with its own
+    user data dir. lease() hands out an idle session, or starts one if there is none. When the lease ends, the
+    session is reset to about:blank with cookies and storage cleared, and then returned to the pool. A session is quit
+    instead once it has served max_uses leases, or if it doesn't respond anymore, e.g., the browser crashed. The pool
+    keeps up to size idle sessions per key and starts replacements in the background.
+
+        with WebDriverPool(size=2) as pool:
+            with pool.lease('chrome', browser_options='--headless') as driver:
+                driver.get(url)
+    """
+
+    def __init__(self, size=1, max_uses=50, debug=False):
+        self.size = size
+        self.max_uses = max_uses
+        self.debug = debug
+        self.idle = collections.defaultdict(list)
+        self.pending = collections.defaultdict(int)
+        self.cond = threading.Condition()
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=max(1, size))
+        self.closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    # Start sessions in the background until there are size idle ones for the key
+    def prelaunch(self, browser_name, browser_path='', browser_options='', webdriver_file='', target_os=''):
+        key = (browser_name, browser_path, browser_options, webdriver_file, target_os)
+        with self.cond:
+            count = self.size - len(self.idle[key]) - self.pending[key]
+            self.pending[key] += max(0, count)
+        for _ in range(count):
+            self.executor.submit(self._launch_idle, key)
+
+    @contextlib.contextmanager
+    def lease(self, browser_name, browser_path='', browser_options='', webdriver_file='', target_os=''):
+        key = (browser_name, browser_path, browser_options, webdriver_file, target_os)
+        session = None
+        with self.cond:
+            while not self.idle[key] and self.pending[key]:
+                self.cond.wait()
+            if self.idle[key]:
+                session = self.idle[key].pop()
+        if not session:
+            session = self._launch(key)
+
+        try:
+            yield session.driver
+        finally:
+            session.uses += 1
+            if self.closed or (self.max_uses and session.uses >= self.max_uses) or not self._reset(session):
+                self._quit(session)
+                if not self.closed:
+                    self.prelaunch(*key)
+            else:
+                with self.cond:
+                    if len(self.idle[key]) < self.size:
+                        self.idle[key].append(session)
+                        session = None
+                if session:
+                    self._quit(session)
+
+    def close(self):
+        self.closed = True
+        self.executor.shutdown(wait=True)
+        with self.cond:
+            sessions = [session for sessions in self.idle.values() for session in sessions]
+            self.idle.clear()
+        for session in sessions:
+            self._quit(session)
+
+    def _launch(self, key):
+        browser_name, browser_path, browser_options, webdriver_file, target_os = key
+        user_data_dir = '%s-pool-%s' % (ScriptRepo.USER_DATA_DIR, uuid.uuid4().hex[:8])
+        driver = Util.get_webdriver(
+            browser_name,
+            browser_path=browser_path,
+            browser_options=browser_options,
+            webdriver_file=webdriver_file,
+            debug=self.debug,
+            target_os=target_os,
+            user_data_dir=user_data_dir,
+        )
+        return _WebDriverSession(driver, user_data_dir)
+
+    def _launch_idle(self, key):
+        session = None
+        try:
+            session = self._launch(key)
+        except BaseException as e:
+            Util.warning('Failed to start webdriver for %s: %s' % (key[0], e))
+        with self.cond:
+            self.pending[key] -= 1
+            if session and not self.closed:
+                self.idle[key].append(session)
+                session = None
+            self.cond.notify_all()
+        if session:
+            self._quit(session)
+
+    # Return False if the session doesn't work anymore
+    def _reset(self, session):
+        driver = session.driver
+        cdp = hasattr(driver, 'execute_cdp_cmd')
+        try:
+            # Storage of the current origin, as about:blank has no storage to clear
+            try:
+                driver.execute_script('window.localStorage.clear(); window.sessionStorage.clear();')
+            except Exception:
+                pass
+            if cdp:
+                # Cookies of all origins, while delete_all_cookies() only deletes those of the current document
+                try:
+                    origins = self._get_origins(driver)
+                    driver.execute_cdp_cmd('Network.clearBrowserCookies', {})
+                    driver.execute_cdp_cmd('Network.clearBrowserCache', {})
+                    for origin in sorted(origins):
+                        driver.execute_cdp_cmd('Storage.clearDataForOrigin', {'origin': origin, 'storageTypes': 'all'})
+                except Exception as e:
+                    Util.warning('Failed to clear browser data: %s' % e)
+            else:
+                driver.delete_all_cookies()
+            driver.get('about:blank')
+            # So that the next lease only finds its own origins in the history
+            if cdp:
+                try:
+                    driver.execute_cdp_cmd('Page.resetNavigationHistory', {})
+                except Exception:
+                    pass
+            return True
+        except Exception as e:
+            Util.warning('Recycle webdriver session: %s' % e)
+            return False
+
+    # Origins the session visited during the lease, which may have left storage behind: pages in the history of the
+    # tab, e.g., after redirects, frames of the current page, resources it loaded, and domains of cookies set by any
+    # of them
+    def _get_origins(self, driver):
+        urls = [entry['url'] for entry in driver.execute_cdp_cmd('Page.getNavigationHistory', {}).get('entries', [])]
+        frames = [driver.execute_cdp_cmd('Page.getFrameTree', {})['frameTree']]
+        while frames:
+            frame = frames.pop()
+            urls.append(frame['frame']['url'])
+            frames += frame.get('childFrames', [])
+        try:
+            urls += driver.execute_script('return performance.getEntriesByType("resource").map(e => e.name);') or []
+        except Exception:
+            pass
+        for cookie in driver.execute_cdp_cmd('Network.getAllCookies', {}).get('cookies', []):
+            domain = cookie['domain'].lstrip('.')
+            urls += ['http://%s' % domain, 'https://%s' % domain]
+
+        origins = set()
+        for url in urls:
+            parts = urllib.parse.urlsplit(url)
+            if parts.scheme in ['http', 'https'] and parts.netloc:
+                origins.add('%s://%s' % (parts.scheme, parts.netloc))
+        return origins
+
+    def _quit(self, session):
+        try:
+            session.driver.quit()
+        except Exception:
+            pass
+        Util.ensure_nodir(session.user_data_dir)
+
 
 class Timer:
     def __init__(self, microsecond=False):
@@ -1701,6 +3744,7 @@ class ScriptRepo:
     IGNORE_DIR = Util.format_slash('%s/ignore' % ROOT_DIR)
     IGNORE_CHROMIUM_DIR = Util.format_slash('%s/chromium' % IGNORE_DIR)
     IGNORE_CHROMIUM_DOWNLOAD_DIR = Util.format_slash('%s/download' % IGNORE_CHROMIUM_DIR)
+    IGNORE_CHROMIUM_INDEX_FILE = Util.format_slash('%s/commit-index.db' % IGNORE_CHROMIUM_DIR)
     IGNORE_LOG_DIR = Util.format_slash('%s/log' % IGNORE_DIR)
     IGNORE_TIMESTAMP_DIR = Util.format_slash('%s/timestamp' % IGNORE_DIR)
     IGNORE_WEBMARK_DIR = Util.format_slash('%s/webmark' % IGNORE_DIR)
@@ -1712,6 +3756,11 @@ class ScriptRepo:
 
     IGNORE_BOTO_FILE = Util.format_slash('%s/boto.conf' % IGNORE_DIR)
     IGNORE_FAIL_FILE = Util.format_slash('%s/FAIL' % IGNORE_DIR)
+    IGNORE_HOST_FILE = Util.format_slash('%s/host.json' % IGNORE_DIR)
+    IGNORE_INVENTORY_FILE = Util.format_slash('%s/inventory.json' % IGNORE_DIR)
+    IGNORE_BROWSER_FILE = Util.format_slash('%s/browser.json' % IGNORE_DIR)
+    IGNORE_MD5_FILE = Util.format_slash('%s/md5.json' % IGNORE_DIR)
+    IGNORE_GIT_INFO_FILE = Util.format_slash('%s/git-info.json' % IGNORE_DIR)
 
     CHROMEDRIVER_FILE = Util.format_slash('%s/webdriver/%s/chromedriver%s' % (TOOL_DIR, Util.HOST_OS, Util.EXEC_SUFFIX))
     if Util.HOST_OS == Util.WINDOWS:
@@ -1735,24 +3784,45 @@ class ChromiumRepo:
     REV_INFO_INDEX_ROLL_HASH = 2
     REV_INFO_INDEX_ROLL_COUNT = 3
 
-    def __init__(self, root_dir):
+    # parse_mode
+    # text: parse the default output of git log line by line
+    # record: ask git log for separator-delimited fields and parse each commit in one pass
+    PARSE_MODE_TEXT = 'text'
+    PARSE_MODE_RECORD = 'record'
+    # <record separator><hash><unit separator><author email><unit separator><date><unit separator><message>
+    # <unit separator>, followed by the shortstat of the commit
+    RECORD_FORMAT = '%x1e%H%x1f%ae%x1f%ad%x1f%B%x1f'
+    RECORD_REV_PATTERN = re.compile(
+        r'^\s*(?:Cr-Commit-Position: refs/heads/(?:main|master)@{#(\d+)}'
+        r'|git-svn-id: svn://svn.chromium.org/chrome/trunk/src@(\d+) )',
+        re.M,
+    )
+    ROLL_PATTERN = re.compile(r'Roll (.*) ([a-zA-Z0-9]+)..([a-zA-Z0-9]+) \((\d+) commits\)')
+    SHORTSTAT_PATTERN = re.compile(r'(\d+) files? changed')
+    INSERTION_PATTERN = re.compile(r'(\d+) insertions?\(\+\)')
+    DELETION_PATTERN = re.compile(r'(\d+) deletions?\(-\)')
+
+    # use_index: persist commits in ChromiumRepoIndex, so that later processes don't run git log for them again
+    def __init__(self, root_dir, use_index=False, parse_mode=PARSE_MODE_TEXT):
         self.repo_dir = f"{root_dir}/src"
         self.info = [self.FAKE_REV, self.FAKE_REV, {}]
+        if use_index:
+            self.index = ChromiumRepoIndex(ScriptRepo.IGNORE_CHROMIUM_INDEX_FILE)
+        else:
+            self.index = None
+        self.parse_mode = parse_mode
 
     def get_working_dir_date(self):
         Util.chdir(self.repo_dir)
-        cmd = 'git log -1 --date=format:"%Y%m%d" --format="%cd"'
-        return Util.execute(cmd, show_cmd=False, return_out=True)[1].rstrip('\n').rstrip('\r')
+        return GitRepoInfo(self.repo_dir).date
 
     def get_working_dir_rev(self):
         Util.chdir(self.repo_dir)
-        cmd = 'git log --shortstat -1'
-        return self._get_head_rev(cmd)
+        return self._get_head_rev('-1')
 
     def get_repo_rev(self, branch='main'):
         Util.chdir(self.repo_dir)
-        cmd = 'git log --shortstat -1 origin/%s' % branch
-        return self._get_head_rev(cmd)
+        return self._get_head_rev('-1 origin/%s' % branch)
 
     def get_hash_from_rev(self, rev, branch='main'):
         if rev not in self.info[self.INFO_INDEX_REV_INFO]:
@@ -1765,12 +3835,17 @@ class ChromiumRepo:
             return
 
         info = self.info
+        # Start from the range in index, so only commits out of it are fetched
+        if self.index and info[self.INFO_INDEX_MIN_REV] == self.FAKE_REV:
+            index_range = self.index.get_range(branch)
+            if index_range:
+                info[self.INFO_INDEX_MIN_REV], info[self.INFO_INDEX_MAX_REV] = index_range
+
         info_min_rev = info[self.INFO_INDEX_MIN_REV]
         info_max_rev = info[self.INFO_INDEX_MAX_REV]
         if info_min_rev <= min_rev and info_max_rev >= max_rev:
-            return
-
-        if info[self.INFO_INDEX_MIN_REV] == self.FAKE_REV:
+            pass
+        elif info[self.INFO_INDEX_MIN_REV] == self.FAKE_REV:
             self._get_info(min_rev, max_rev, branch)
             info[self.INFO_INDEX_MIN_REV] = min_rev
             info[self.INFO_INDEX_MAX_REV] = max_rev
@@ -1782,24 +3857,81 @@ class ChromiumRepo:
                 self._get_info(info_max_rev + 1, max_rev, branch)
                 info[self.INFO_INDEX_MAX_REV] = max_rev
 
+        if self.index:
+            self.index.load_rev_info(min_rev, max_rev, info[self.INFO_INDEX_REV_INFO])
+
+    # fetch commits newer than the head of index
+    def update_index(self, branch='main'):
+        index_range = self.index.get_range(branch)
+        if index_range:
+            self.get_info(index_range[1] + 1, self.get_repo_rev(branch), branch)
+
     def _get_info(self, min_rev, max_rev, branch):
         info = self.info
         head_rev = self.get_repo_rev(branch)
         if max_rev > head_rev:
             Util.error('Revision %s is not ready' % max_rev)
-        cmd = 'git log --shortstat origin/%s~%s..origin/%s~%s ' % (
+        args = 'origin/%s~%s..origin/%s~%s ' % (
             branch,
             head_rev - min_rev + 1,
             branch,
             head_rev - max_rev,
         )
-        _, out = Util.execute(cmd, show_cmd=False, return_out=True)
-        lines = out.split('\n')
 
         rev_info = info[self.INFO_INDEX_REV_INFO]
-        self._parse_lines(lines, rev_info)
+        if self.index:
+            commits = {}
+            self._log(args, rev_info, commits)
+            self.index.add(commits, branch, min_rev, max_rev)
+        else:
+            self._log(args, rev_info)
+
+    # run git log --shortstat with args, and parse its output into rev_info (and commits) per parse_mode
+    def _log(self, args, rev_info, commits=None):
+        if self.parse_mode == self.PARSE_MODE_RECORD:
+            cmd = 'git log --shortstat --format="%s" %s' % (self.RECORD_FORMAT, args)
+            _, out = Util.execute(cmd, show_cmd=False, return_out=True)
+            self._parse_records(out, rev_info, commits)
+        else:
+            cmd = 'git log --shortstat %s' % args
+            _, out = Util.execute(cmd, show_cmd=False, return_out=True)
+            self._parse_lines(out.split('\n'), rev_info, commits)
+
+    # Parse the output of git log in RECORD_FORMAT, with the same result as _parse_lines()
+    def _parse_records(self, out, rev_info, commits=None):
+        for record in out.split('\x1e')[1:]:
+            commit_hash, author, date, message, shortstat = record.split('\x1f')
+            match = self.SHORTSTAT_PATTERN.search(shortstat)
+            if not match:
+                continue
+
+            match = self.RECORD_REV_PATTERN.search(message)
+            if match:
+                rev = int(match.group(1) or match.group(2))
+            else:
+                rev = self.FAKE_REV
+            # Strip the suffix of svn era author, e.g., <name>@chromium.org@0039d316-1c4b-4281-b951-d872f2087c98
+            if author.count('@') > 1:
+                author = author.rsplit('@', 1)[0]
+            subject = message.split('\n', 1)[0].strip()
+            match = self.INSERTION_PATTERN.search(shortstat)
+            insertion = int(match.group(1)) if match else 0
+            match = self.DELETION_PATTERN.search(shortstat)
+            deletion = int(match.group(1)) if match else 0
+
+            commit = ChromiumCommit(rev, commit_hash, author, date.strip(), subject, insertion, deletion)
+            match = self.ROLL_PATTERN.match(subject)
+            if match and match.group(1) != 'src-internal':
+                commit.roll_repo = match.group(1)
+                commit.roll_hash = match.group(3)
+                commit.roll_count = int(match.group(4))
+
+            rev_info[rev] = [commit.hash, commit.roll_repo, commit.roll_hash, commit.roll_count]
+            if commits is not None:
+                commits[rev] = commit
 
-    def _parse_lines(self, lines, rev_info):
+    # commits: if not None, also collect {rev: ChromiumCommit}
+    def _parse_lines(self, lines, rev_info, commits=None):
         tmp_hash = ''
         tmp_author = ''
         tmp_date = ''
@@ -1847,6 +3979,20 @@ class ChromiumRepo:
                     rev_info[tmp_rev][self.REV_INFO_INDEX_ROLL_REPO] = match.group(1)
                     rev_info[tmp_rev][self.REV_INFO_INDEX_ROLL_HASH] = match.group(3)
                     rev_info[tmp_rev][self.REV_INFO_INDEX_ROLL_COUNT] = int(match.group(4))
+                if commits is not None:
+                    roll_repo, roll_hash, roll_count = rev_info[tmp_rev][self.REV_INFO_INDEX_ROLL_REPO :]
+                    commits[tmp_rev] = ChromiumCommit(
+                        tmp_rev,
+                        tmp_hash,
+                        tmp_author,
+                        tmp_date,
+                        tmp_subject,
+                        tmp_insertion,
+                        tmp_deletion,
+                        roll_repo,
+                        roll_hash,
+                        roll_count,
+                    )
 
     def _parse_line(
         self,
@@ -1922,15 +4068,113 @@ class ChromiumRepo:
 
         return (tmp_rev, tmp_hash, tmp_author, tmp_date, tmp_subject, tmp_insertion, tmp_deletion, tmp_is_roll)
 
-    def _get_head_rev(self, cmd):
-        _, out = Util.execute(cmd, show_cmd=False, return_out=True)
-        lines = out.split('\n')
+    def _get_head_rev(self, args):
         rev_info = {}
-        self._parse_lines(lines, rev_info=rev_info)
+        self._log(args, rev_info)
         for key in rev_info:
             return key
 
 
+class ChromiumCommit:
+    __slots__ = (
+        'rev',
+        'hash',
+        'author',
+        'date',
+        'subject',
+        'insertion',
+        'deletion',
+        'roll_repo',
+        'roll_hash',
+        'roll_count',
+    )
+
+    def __init__(self, rev, hash, author, date, subject, insertion, deletion, roll_repo='', roll_hash='', roll_count=0):
+        self.rev = rev
+        self.hash = hash
+        self.author = author
+        self.date = date
+        self.subject = subject
+        self.insertion = insertion
+        self.deletion = deletion
+        self.roll_repo = roll_repo
+        self.roll_hash = roll_hash
+        self.roll_count = roll_count
+
+
+class ChromiumRepoIndex:
+    """SQLite index of Chromium commits keyed on commit position.
+
+    For each branch, the index covers a contiguous range of revisions, which grows as ChromiumRepo fetches
+    commits before or after it.
+    """
+
+    def __init__(self, index_file):
+        Util.ensure_dir(os.path.dirname(index_file))
+        self.conn = sqlite3.connect(index_file)
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS commits (rev INTEGER PRIMARY KEY, hash TEXT, author TEXT, date TEXT, '
+            'subject TEXT, insertion INTEGER, deletion INTEGER, roll_repo TEXT, roll_hash TEXT, roll_count INTEGER)'
+        )
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS ranges (branch TEXT PRIMARY KEY, min_rev INTEGER, max_rev INTEGER)'
+        )
+        self.conn.commit()
+
+    def get_range(self, branch):
+        row = self.conn.execute('SELECT min_rev, max_rev FROM ranges WHERE branch = ?', (branch,)).fetchone()
+        if row:
+            return tuple(row)
+        return None
+
+    # return ChromiumCommit of rev
+    def get_commit(self, rev):
+        row = self.conn.execute('SELECT * FROM commits WHERE rev = ?', (rev,)).fetchone()
+        if row:
+            return ChromiumCommit(*row)
+        return None
+
+    # add rev_info of revisions in [min_rev, max_rev] to rev_info
+    def load_rev_info(self, min_rev, max_rev, rev_info):
+        if all(rev in rev_info for rev in range(min_rev, max_rev + 1)):
+            return
+        rows = self.conn.execute(
+            'SELECT rev, hash, roll_repo, roll_hash, roll_count FROM commits WHERE rev BETWEEN ? AND ?',
+            (min_rev, max_rev),
+        )
+        for row in rows:
+            if row[0] not in rev_info:
+                rev_info[row[0]] = list(row[1:])
+
+    # commits are {rev: ChromiumCommit} of [min_rev, max_rev], which must be adjacent to or overlap the range of
+    # branch
+    def add(self, commits, branch, min_rev, max_rev):
+        index_range = self.get_range(branch)
+        if index_range:
+            min_rev = min(min_rev, index_range[0])
+            max_rev = max(max_rev, index_range[1])
+        with self.conn:
+            self.conn.executemany(
+                'INSERT OR REPLACE INTO commits VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (
+                    (
+                        commit.rev,
+                        commit.hash,
+                        commit.author,
+                        commit.date,
+                        commit.subject,
+                        commit.insertion,
+                        commit.deletion,
+                        commit.roll_repo,
+                        commit.roll_hash,
+                        commit.roll_count,
+                    )
+                    for commit in commits.values()
+                ),
+            )
+            self.conn.execute('INSERT OR REPLACE INTO ranges VALUES (?, ?, ?)', (branch, min_rev, max_rev))
+
+
 class Program(object):
     def __init__(self, parser=None, root_dir=None, target_arch='default', target_os='default', timestamp='second'):
         if parser:
@@ -2019,7 +4263,17 @@ class Program(object):
         Util.ensure_dir(ScriptRepo.IGNORE_TIMESTAMP_DIR)
         Util.ensure_dir(ScriptRepo.IGNORE_LOG_DIR)
 
-    def _execute(self, cmd, show_cmd=True, exit_on_error=True, return_out=False, show_duration=False, dryrun=False):
+    def _execute(
+        self,
+        cmd,
+        show_cmd=True,
+        exit_on_error=True,
+        return_out=False,
+        show_duration=False,
+        dryrun=False,
+        fail_file=True,
+        stream=False,
+    ):
         return Util.execute(
             cmd=cmd,
             show_cmd=show_cmd,
@@ -2028,6 +4282,21 @@ class Program(object):
             show_duration=show_duration,
             dryrun=dryrun,
             log_file=self.log_file,
+            fail_file=fail_file,
+            stream=stream,
+        )
+
+    async def _execute_async(
+        self, cmd, show_cmd=True, exit_on_error=True, return_out=False, show_duration=False, timeout=0
+    ):
+        return await Util.execute_async(
+            cmd=cmd,
+            show_cmd=show_cmd,
+            exit_on_error=exit_on_error,
+            return_out=return_out,
+            show_duration=show_duration,
+            log_file=self.log_file,
+            timeout=timeout,
         )
 
     def _simple_execute(self, cmd, show_cmd=True, exit_on_error=True, show_duration=False, dryrun=False):
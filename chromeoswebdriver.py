@@ -1,22 +1,35 @@
 import atexit
+import os
 import urllib2
 import re
 import socket
 import subprocess
+import threading
 from telemetry.internal.browser import browser_finder, browser_options
 from selenium import webdriver
 
 CHROMEDRIVER_EXE_PATH = '/usr/local/chromedriver/chromedriver'
+# Written by Chrome in its user data dir with the remote debugging port in the first line
+DEVTOOLS_ACTIVE_PORT_FILE = '/home/chronos/DevToolsActivePort'
+
+_shared_server = None
+_shared_server_lock = threading.Lock()
 
 
 class chromedriver(object):
-    def __init__(self, extra_chrome_flags=[], username=None, password=None):
+    # shared_server: attach to the chromedriver server shared by all sessions of the process instead of starting one
+    def __init__(self, extra_chrome_flags=[], username=None, password=None, shared_server=False):
         self._chrome = Chrome(username=username, password=password, extra_browser_args=extra_chrome_flags)
         self._browser = self._chrome._browser
         self._browser.tabs[0].Close()
-        self._server = chromedriver_server(CHROMEDRIVER_EXE_PATH)
-        urllib2.urlopen('http://localhost:%i/json/new' % get_chrome_remote_debugging_port())
-        chromeOptions = {'debuggerAddress': ('localhost:%d' % get_chrome_remote_debugging_port())}
+        self._shared_server = shared_server
+        if shared_server:
+            self._server = get_shared_server()
+        else:
+            self._server = chromedriver_server(CHROMEDRIVER_EXE_PATH)
+        port = get_chrome_remote_debugging_port()
+        urllib2.urlopen('http://localhost:%i/json/new' % port)
+        chromeOptions = {'debuggerAddress': ('localhost:%d' % port)}
         capabilities = {'chromeOptions': chromeOptions}
         self.driver = webdriver.Remote(command_executor=self._server.url, desired_capabilities=capabilities)
 
@@ -26,30 +39,36 @@ class chromedriver(object):
     def __exit__(self, *args):
         self.driver.close()
         del self.driver
-        self._server.close()
+        if not self._shared_server:
+            self._server.close()
         del self._server
         self._browser.Close()
         del self._browser
 
 
 class chromedriver_server(object):
-    def __init__(self, exe_path):
+    # log_path: file to append the output of chromedriver to. The output is discarded by default, as nobody reads it,
+    # and a long-lived server would block once a pipe is full.
+    def __init__(self, exe_path, log_path=None):
         chromedriver_args = [exe_path]
         port = get_unused_port()
         chromedriver_args.append('--port=%d' % port)
         self.url = 'http://localhost:%d' % port
+        self.log = open(log_path or os.devnull, 'a')
         self.sp = subprocess.Popen(
-            chromedriver_args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, stdin=subprocess.PIPE, env=None
+            chromedriver_args, stdout=self.log, stderr=subprocess.STDOUT, stdin=subprocess.PIPE, env=None
         )
         atexit.register(self.close)
 
+    def is_alive(self):
+        return self.sp.poll() is None
+
     def close(self):
         try:
             urllib2.urlopen(self.url + '/shutdown', timeout=10).close()
         except:
             pass
-        self.sp.stdout.close()
-        self.sp.stderr.close()
+        self.log.close()
 
 
 class Chrome(object):
@@ -82,7 +101,25 @@ class Chrome(object):
         self.close()
 
 
+# Return the chromedriver server shared by all sessions of the process, which is started on first use or if it died
+def get_shared_server(exe_path=CHROMEDRIVER_EXE_PATH, log_path=None):
+    global _shared_server
+    with _shared_server_lock:
+        if not _shared_server or not _shared_server.is_alive():
+            _shared_server = chromedriver_server(exe_path, log_path)
+        return _shared_server
+
+
 def get_chrome_remote_debugging_port():
+    # The file may be left over by a crashed Chrome, so only trust the port if it's listening
+    try:
+        with open(DEVTOOLS_ACTIVE_PORT_FILE) as f:
+            port = int(f.readline())
+        socket.create_connection(('localhost', port), timeout=1).close()
+        return port
+    except (IOError, ValueError, socket.error):
+        pass
+
     chromepid = int(subprocess.check_output(['pgrep', '-o', '^chrome$']))
     command = subprocess.check_output(['ps', '-p', str(chromepid), '-o', 'command='])
     matches = re.search('--remote-debugging-port=([0-9]+)', command)